@@ -1,5 +1,6 @@
 import os
 import sys
+from logger import logger
 from magic import Magic
 import socket
 import select
@@ -86,12 +87,15 @@ class Route:
 
 
 class ClientHandler(threading.Thread):
-  def __init__(self, socket, routes):
+  def __init__(self, socket, address, routes):
     threading.Thread.__init__(self)
 
     self.socket = socket
     self.routes: List[Route] = routes
 
+    host, port = address[:2]
+    self.peer = f"{host}:{port}"
+
   def run(self):
     while True:
       request = self.socket.recv(4096)
@@ -102,8 +106,8 @@ class ClientHandler(threading.Thread):
 
         request = request.decode("utf-8")
 
-        print(self.socket.getpeername(), end=": ")
-        print(request)
+        logger.sampled("info", "request", peer=self.peer, request=request.split("\r\n", 1)[0])
+        logger.debug("request_raw", peer=self.peer, request=request)
 
         try:
           for route in self.routes:
@@ -116,7 +120,8 @@ class ClientHandler(threading.Thread):
           if not is_match:
             response = Response.get_404_response().create()
 
-        except:
+        except Exception as e:
+          logger.error("error", peer=self.peer, error=str(e))
           response = Response.get_500_response().create()
 
         self.socket.sendall(response)
@@ -167,15 +172,21 @@ class HttpServer:
 
         for ready_socket in read_ready_sockets:
           if ready_socket == self.socket:
-            client_socket, _ = self.socket.accept()
+            try:
+              client_socket, address = self.socket.accept()
+            except OSError:
+              continue
 
-            client = ClientHandler(client_socket, self.routes)
+            client = ClientHandler(client_socket, address, self.routes)
             client.start()
             self.threads.append(client)
 
       except KeyboardInterrupt:
         is_running = False
 
+    logger.info("server_closing")
     self.socket.close()
     for client in self.threads:
       client.join()
+
+    logger.flush()
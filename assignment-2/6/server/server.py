@@ -1,11 +1,21 @@
 import routes
 import config
+from logger import logger
 from httpserver import HttpServer
 
 
 if __name__ == '__main__':
   config = config.get_config('./httpserver.conf')
 
+  log = config.get('log', {})
+  logger.configure(
+    log.get('level', 'info'),
+    log.get('format', 'text'),
+    log.get('file', ''),
+    float(log.get('sample', 1.0)),
+    int(log.get('queue_size', 10000))
+  )
+
   server = HttpServer(
     config['server']['host'],
     int(config['server']['port'])
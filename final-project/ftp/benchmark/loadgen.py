@@ -0,0 +1,141 @@
+from report import Recorder
+from session import BenchmarkError, BenchmarkSession
+from threading import Thread
+from typing import Dict, List
+import os
+import random
+import time
+
+
+class LoadGenerator:
+  UNITS = {"k": 1024, "m": 1024 * 1024, "g": 1024 * 1024 * 1024}
+
+  def __init__(self, host: str, port: int, user: str, password: str, sessions: int = 8, duration: float = 10.0, \
+    operations: int = 20, mix: str = "list=1,retr=6,stor=3", sizes: str = "4k,64k,1m", directory: str = "/bench", \
+    seed: int = 1) -> None:
+    self.host = host
+    self.port = port
+    self.user = user
+    self.password = password
+    self.sessions = sessions
+    self.duration = duration
+    self.operations = operations
+    self.directory = directory
+    self.seed = seed
+
+    self.mix = LoadGenerator.parse_mix(mix)
+    self.sizes = [LoadGenerator.parse_size(size) for size in sizes.split(",") if size.strip()]
+    self.payloads: Dict[int, memoryview] = {size: memoryview(os.urandom(size)) for size in set(self.sizes)}
+
+    self.recorder = Recorder()
+    self.deadline = 0.0
+
+  @staticmethod
+  def parse_size(size: str) -> int:
+    size = size.strip().lower()
+
+    if size[-1:] in LoadGenerator.UNITS:
+      return int(float(size[:-1]) * LoadGenerator.UNITS[size[-1]])
+
+    return int(size)
+
+  @staticmethod
+  def parse_mix(mix: str) -> List[str]:
+    verbs = []
+
+    for item in mix.split(","):
+      verb, _, weight = item.partition("=")
+      verb = verb.strip().upper()
+
+      if verb not in ("LIST", "RETR", "STOR"):
+        raise ValueError(f"Unknown operation in mix: {verb}")
+
+      verbs += [verb] * int(weight or 1)
+
+    return verbs
+
+  def fixture(self, size: int) -> str:
+    return f"fixture-{size}.bin"
+
+  def session(self) -> BenchmarkSession:
+    session = BenchmarkSession(self.host, self.port, self.recorder)
+    session.connect()
+    session.login(self.user, self.password)
+
+    return session
+
+  def setup(self) -> None:
+    session = self.session()
+
+    try:
+      try:
+        session.command(f"CWD {self.directory}", (250,))
+      except BenchmarkError:
+        session.command(f"MKD {self.directory}", (250, 257))
+        session.command(f"CWD {self.directory}", (250,))
+
+      for size, payload in self.payloads.items():
+        session.transfer(f"STOR {self.fixture(size)}", payload)
+
+    finally:
+      session.close()
+
+  def worker(self, index: int) -> None:
+    generator = random.Random(self.seed * 1000003 + index)
+
+    while time.monotonic() < self.deadline:
+      session = None
+
+      try:
+        session = self.session()
+        session.command(f"CWD {self.directory}", (250,))
+
+        for _ in range(self.operations):
+          if time.monotonic() >= self.deadline:
+            break
+
+          verb = generator.choice(self.mix)
+          size = generator.choice(self.sizes)
+
+          if verb == "LIST":
+            session.transfer("LIST")
+          elif verb == "RETR":
+            session.transfer(f"RETR {self.fixture(size)}")
+          else:
+            session.transfer(f"STOR upload-{index}.bin", self.payloads[size])
+
+      except (OSError, BenchmarkError):
+        self.recorder.add("failed_sessions", 1)
+        time.sleep(0.05)
+
+      finally:
+        if session:
+          session.close()
+
+  def run(self) -> dict:
+    self.setup()
+
+    # Setup traffic is not part of the measurement.
+    self.recorder = Recorder()
+
+    threads = [Thread(target=self.worker, args=(index,), daemon=True) for index in range(self.sessions)]
+
+    start = time.monotonic()
+    self.deadline = start + self.duration
+
+    for thread in threads:
+      thread.start()
+
+    for thread in threads:
+      thread.join()
+
+    return self.recorder.report(time.monotonic() - start, {
+      "host": self.host,
+      "port": self.port,
+      "sessions": self.sessions,
+      "duration": self.duration,
+      "operations_per_session": self.operations,
+      "mix": {verb: self.mix.count(verb) for verb in sorted(set(self.mix))},
+      "sizes": sorted(set(self.sizes)),
+      "seed": self.seed,
+    })
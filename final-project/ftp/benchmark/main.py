@@ -0,0 +1,38 @@
+from loadgen import LoadGenerator
+import argparse
+import json
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description='Drive concurrent FTP sessions against a server and report as JSON')
+  parser.add_argument('--host', help='specify the host that will be connected to', type=str, default='127.0.0.1')
+  parser.add_argument('--port', help='specify the port which is used', type=int, default=60000)
+  parser.add_argument('--user', help='specify the login user', type=str, default='netpro')
+  parser.add_argument('--password', help='specify the login password', type=str, default='123')
+  parser.add_argument('--sessions', help='specify the number of concurrent sessions', type=int, default=8)
+  parser.add_argument('--duration', help='specify the run time in seconds', type=float, default=10.0)
+  parser.add_argument('--operations', help='specify the operations per session before reconnecting', type=int, default=20)
+  parser.add_argument('--mix', help='specify weighted operations, e.g. list=1,retr=6,stor=3', type=str, default='list=1,retr=6,stor=3')
+  parser.add_argument('--sizes', help='specify file sizes, e.g. 4k,64k,1m', type=str, default='4k,64k,1m')
+  parser.add_argument('--directory', help='specify the server directory used for the run', type=str, default='/bench')
+  parser.add_argument('--seed', help='specify the random seed', type=int, default=1)
+  parser.add_argument('--output', help='specify a file for the JSON report', type=str, default='')
+
+  args = parser.parse_args()
+
+  try:
+    generator = LoadGenerator(
+      args.host, args.port, args.user, args.password, args.sessions, args.duration, args.operations,
+      args.mix, args.sizes, args.directory, args.seed
+    )
+
+    report = json.dumps(generator.run(), indent=2)
+
+    if args.output:
+      with open(args.output, 'w') as file:
+        file.write(report + '\n')
+
+    print(report)
+
+  except Exception as e:
+    print(e)
@@ -0,0 +1,69 @@
+from threading import Lock
+from typing import Dict, List
+import math
+
+
+class Recorder:
+  def __init__(self) -> None:
+    self.samples: Dict[str, List[float]] = {}
+    self.errors: Dict[str, int] = {}
+    self.counters: Dict[str, int] = {}
+    self.lock = Lock()
+
+  def record(self, verb: str, seconds: float) -> None:
+    with self.lock:
+      self.samples.setdefault(verb, []).append(seconds)
+
+  def error(self, verb: str) -> None:
+    with self.lock:
+      self.errors[verb] = self.errors.get(verb, 0) + 1
+
+  def add(self, name: str, value: int) -> None:
+    with self.lock:
+      self.counters[name] = self.counters.get(name, 0) + value
+
+  @staticmethod
+  def percentile(samples: List[float], fraction: float) -> float:
+    index = max(0, math.ceil(fraction * len(samples)) - 1)
+    return samples[index]
+
+  def summary(self, verb: str) -> dict:
+    samples = sorted(self.samples.get(verb, []))
+    summary = {"count": len(samples), "errors": self.errors.get(verb, 0)}
+
+    if samples:
+      summary.update({
+        "mean_ms": round(sum(samples) / len(samples) * 1000, 3),
+        "p50_ms": round(Recorder.percentile(samples, 0.50) * 1000, 3),
+        "p95_ms": round(Recorder.percentile(samples, 0.95) * 1000, 3),
+        "p99_ms": round(Recorder.percentile(samples, 0.99) * 1000, 3),
+        "max_ms": round(samples[-1] * 1000, 3),
+      })
+
+    return summary
+
+  def report(self, elapsed: float, config: dict) -> dict:
+    with self.lock:
+      verbs = sorted(set(self.samples) | set(self.errors))
+      counters = dict(self.counters)
+      operations = sum(len(self.samples.get(verb, [])) for verb in ("LIST", "RETR", "STOR"))
+      errors = sum(self.errors.values())
+
+      commands = {verb: self.summary(verb) for verb in verbs}
+
+    transferred = counters.get("bytes_sent", 0) + counters.get("bytes_received", 0)
+
+    return {
+      "config": config,
+      "elapsed_seconds": round(elapsed, 3),
+      "connections": counters.get("connections", 0),
+      "connections_per_second": round(counters.get("connections", 0) / elapsed, 2),
+      "operations": operations,
+      "operations_per_second": round(operations / elapsed, 2),
+      "errors": errors,
+      "failed_sessions": counters.get("failed_sessions", 0),
+      "bytes_sent": counters.get("bytes_sent", 0),
+      "bytes_received": counters.get("bytes_received", 0),
+      "throughput_mib_per_second": round(transferred / elapsed / (1024 * 1024), 3),
+      "commands": commands,
+    }
@@ -0,0 +1,152 @@
+from report import Recorder
+from typing import Optional, Tuple
+import socket
+import time
+
+
+class BenchmarkError(Exception):
+  pass
+
+
+class BenchmarkSession:
+  def __init__(self, host: str, port: int, recorder: Recorder, timeout: float = 30.0, buffer_size: int = 256 * 1024) -> None:
+    self.host = host
+    self.port = port
+    self.recorder = recorder
+    self.timeout = timeout
+
+    self.socket: socket.socket = None
+    self.buffer = b""
+    self.is_greeted = False
+    self.receive_buffer = bytearray(buffer_size)
+
+  def connect(self) -> None:
+    start = time.perf_counter()
+
+    self.socket = socket.create_connection((self.host, self.port), self.timeout)
+    self.socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    self.buffer = b""
+    self.is_greeted = False
+
+    self.recorder.record("CONNECT", time.perf_counter() - start)
+    self.recorder.add("connections", 1)
+
+  def close(self) -> None:
+    if not self.socket:
+      return
+
+    try:
+      self.socket.sendall(b"QUIT\r\n")
+      self.read_reply()
+    except (OSError, BenchmarkError):
+      pass
+
+    self.socket.close()
+    self.socket = None
+
+  def read_line(self) -> str:
+    while b"\r\n" not in self.buffer:
+      data = self.socket.recv(4096)
+      if not data:
+        raise BenchmarkError("Control connection closed.")
+
+      self.buffer += data
+
+    line, self.buffer = self.buffer.split(b"\r\n", 1)
+    return line.decode("utf-8", errors="replace")
+
+  def read_reply(self) -> Tuple[int, str]:
+    line = self.read_line()
+    reply = line
+
+    if line[3:4] == "-":
+      while not line.startswith(f"{reply[:3]} "):
+        line = self.read_line()
+        reply += "\r\n" + line
+
+    # The server sends its greeting together with the first reply.
+    if not self.is_greeted and reply.startswith("220 "):
+      self.is_greeted = True
+      return self.read_reply()
+
+    self.is_greeted = True
+    return int(reply[:3]), reply
+
+  def command(self, line: str, expected: Tuple[int, ...] = (200,), verb: Optional[str] = None) -> str:
+    verb = verb or line.split()[0].upper()
+    start = time.perf_counter()
+
+    self.socket.sendall(f"{line}\r\n".encode("utf-8"))
+    code, reply = self.read_reply()
+
+    if code not in expected:
+      self.recorder.error(verb)
+      raise BenchmarkError(reply)
+
+    self.recorder.record(verb, time.perf_counter() - start)
+    return reply
+
+  def login(self, user: str, password: str) -> None:
+    start = time.perf_counter()
+
+    self.command(f"USER {user}", (331,))
+    self.command(f"PASS {password}", (230,))
+    self.command("TYPE I", (200,))
+
+    self.recorder.record("LOGIN", time.perf_counter() - start)
+
+  def pasv(self) -> socket.socket:
+    reply = self.command("PASV", (227,))
+
+    fields = reply[reply.index("(") + 1:reply.index(")")].split(",")
+    address = ".".join(fields[:4])
+    port = int(fields[4]) * 256 + int(fields[5])
+
+    data_socket = socket.create_connection((address, port), self.timeout)
+    data_socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    return data_socket
+
+  def transfer(self, line: str, payload: Optional[memoryview] = None) -> int:
+    verb = line.split()[0].upper()
+    data_socket = self.pasv()
+
+    start = time.perf_counter()
+    size = 0
+
+    try:
+      self.socket.sendall(f"{line}\r\n".encode("utf-8"))
+      code, reply = self.read_reply()
+
+      if code not in (125, 150):
+        raise BenchmarkError(reply)
+
+      if payload is not None:
+        data_socket.sendall(payload)
+        size = len(payload)
+        data_socket.shutdown(socket.SHUT_WR)
+
+      while True:
+        received = data_socket.recv_into(self.receive_buffer)
+        if not received:
+          break
+
+        size += received
+
+      data_socket.close()
+
+      code, reply = self.read_reply()
+      if code != 226:
+        raise BenchmarkError(reply)
+
+    except (OSError, BenchmarkError):
+      self.recorder.error(verb)
+      raise
+
+    finally:
+      data_socket.close()
+
+    self.recorder.record(verb, time.perf_counter() - start)
+    self.recorder.add("bytes_sent" if payload is not None else "bytes_received", size)
+
+    return size
@@ -1,8 +1,9 @@
+import codecs
 import socket
 import os
 from handler import DataConnection, DataHandler
 from typing import List
-from utils import Path, Input, Socket
+from utils import Path, Input, ReplyReader, Socket
 
 
 class FTPClient:
@@ -32,15 +33,19 @@ class FTPClient:
   def connect(self) -> bool:
     if self.socket.connect():
       self.socket = self.socket.get()
+      self.reader = ReplyReader(self.socket)
 
       return True
 
     return False
   
   def send(self, command: str) -> str:
+    self.data_connection.wait()
     self.socket.send(command.encode('utf-8'))
 
-    buffer = self.socket.recv(1024).decode('utf-8')
+    buffer = self.reader.read()
+    if buffer.startswith("220 "):
+      buffer += self.reader.read()
     reply = buffer.strip().split('\r\n')
 
     for message in reply:
@@ -52,6 +57,9 @@ class FTPClient:
     return buffer
 
   def pasv(self):
+    if self.data_connection.is_idle() and self.data_connection.mode == "B":
+      self.data_connection.close()
+
     if self.data_connection.handler:
       print(f"There is still connection on transfering data.\n")
       return
@@ -68,7 +76,7 @@ class FTPClient:
       print(f"\tFailed to open data connection.\n")
 
     else:
-      self.data_connection.set_handler(DataHandler(data_socket.get()))
+      self.data_connection.set_handler(DataHandler(data_socket.get(), self.data_connection))
       print(f"\tSuccess to open data connection.\n")
   
   def type(self, command: str):
@@ -78,12 +86,18 @@ class FTPClient:
       data_type = command.split()[1]
       self.data_connection.set_type(data_type)
 
+  def mode(self, command: str):
+    reply = self.send(f"{command}\r\n")
+
+    if "200" in reply:
+      self.data_connection.mode = command.split()[1].upper()
+
   def list(self, command: str):
     reply = self.send(f'{command}\r\n')
 
     if "150" in reply:
       def callback(server_socket: socket.socket):
-        datas = DataHandler.get_data(server_socket)
+        datas = self.data_connection.receive(server_socket)
 
         dirs = []
         files = []
@@ -117,106 +131,154 @@ class FTPClient:
       self.data_connection.handler.set_callback(callback)
       return
 
-    self.data_connection.handler = None
+    self.data_connection.discard()
 
   def handle_directory(self, directory) -> str:
     return Path.merge(self.root, directory)
 
+  def size(self, filename: str) -> int:
+    reply = self.send(f'SIZE {filename}\r\n')
+
+    if reply.startswith("213"):
+      return int(reply.split()[1])
+
+    return -1
+
+  def restart(self, offset: int) -> bool:
+    return offset > 0 and self.send(f'REST {offset}\r\n').startswith("350")
+
   def retr(self, command: str):
-    reply = self.send(f'{command}\r\n')
+    arguments = command.split()[1:]
 
-    if "150" in reply:
-      arguments = command.split()[1:]
+    if not arguments:
+      self.send(f'{command}\r\n')
+      self.data_connection.discard()
+      return
+
+    filename = arguments[0].split("/")[-1]
+    filepath = ""
+
+    print()
+    if len(arguments) == 1:
+      filepath = Input.get_input_by_confirm(
+        f"Make the same filename ({filename}) to put downloaded file? (y/n) ",
+        "What is the filename? ",
+        f"/{filename}"
+      )
 
-      filename = arguments[0].split("/")[-1]
-      filepath = ""
+    elif len(arguments) == 2:
+      filepath = arguments[1]
 
-      print()
-      if len(arguments) == 1:
-        filepath = Input.get_input_by_confirm(
-          f"Make the same filename ({filename}) to put downloaded file? (y/n) ",
-          "What is the filename? ",
-          f"/{filename}"
-        )
+    if len(filepath):
+      filepath = self.handle_directory(filepath)
+      filename = filepath.split('/')[-1]
+      filedir = filepath.replace(f"/{filename}", "")
 
-      elif len(arguments) == 2:
-        filepath = arguments[1]
+      if os.path.isdir(filedir):
+        offset = 0
+        if self.data_connection.type == "utf-8" and os.path.isfile(filepath):
+          local_size = os.path.getsize(filepath)
 
-      if len(filepath):
-        filepath = self.handle_directory(filepath)
-        filename = filepath.split('/')[-1]
-        filedir = filepath.replace(f"/{filename}", "")
+          if 0 < local_size < self.size(arguments[0]) and self.restart(local_size):
+            offset = local_size
 
-        if os.path.isdir(filedir):
+        reply = self.send(f'RETR {arguments[0]}\r\n')
+
+        if "150" in reply:
           def callback(server_socket: socket.socket):
-            print(f"\nDownloading {arguments[0]}.")
-            content = DataHandler.get_data(server_socket)
+            if offset:
+              print(f"\nResuming {arguments[0]} from byte {offset}.")
+            else:
+              print(f"\nDownloading {arguments[0]}.")
+
+            mode = self.data_connection.get_write_type()
+            if offset:
+              mode = "ab"
+
+            decoder = None
+            if "b" not in mode:
+              decoder = codecs.getincrementaldecoder(self.data_connection.type)()
 
-            if self.data_connection.type == "ascii":
-              content = content.decode(self.data_connection.type)
+            with open(filepath, mode) as file:
+              for content in self.data_connection.chunks(server_socket):
+                file.write(decoder.decode(content) if decoder else content)
 
-            with open(filepath, self.data_connection.get_write_type()) as file:
-              file.write(content)
+              if decoder:
+                file.write(decoder.decode(b"", final=True))
 
             print("\tDownload success.\n")
 
           self.data_connection.handler.set_callback(callback)
           return
 
-        else:
-          print("\nDownload failed, directory not found.\n")
-
       else:
-        print("\nDownload failed, please specify the target filename.\n")
+        print("\nDownload failed, directory not found.\n")
+
+    else:
+      print("\nDownload failed, please specify the target filename.\n")
 
-    self.data_connection.handler = None
+    self.data_connection.discard()
 
   def stor(self, command: str):
-    reply = self.send(f'{command}\r\n')
+    arguments = command.split()[1:]
 
-    if "150" in reply:
-      arguments = command.split()[1:]
+    if not arguments:
+      self.send(f'{command}\r\n')
+      self.data_connection.discard()
+      return
+
+    filename = arguments[0].split('/')[-1]
+    filepath = ""
+
+    print()
+    if len(arguments) == 1:
+      filepath = Input.get_input_by_confirm(
+        f"Choose the same filename ({filename}) to upload? (y/n) ",
+        "Which file? ",
+        f"/{filename}"
+      )
+
+    elif len(arguments) == 2:
+      filepath = arguments[0]
 
-      filename = arguments[0].split('/')[-1]
-      filepath = ""
+    if len(filepath):
+      target_path = self.handle_directory(filepath)
 
-      print()
-      if len(arguments) == 1:
-        filepath = Input.get_input_by_confirm(
-          f"Choose the same filename ({filename}) to upload? (y/n) ",
-          "Which file? ",
-          f"/{filename}"
-        )
+      if os.path.isfile(target_path):
+        offset = 0
+        if self.data_connection.type == "utf-8":
+          remote_size = self.size(arguments[-1])
 
-      elif len(arguments) == 2:
-        filepath = arguments[0]
+          if 0 < remote_size < os.path.getsize(target_path) and self.restart(remote_size):
+            offset = remote_size
 
-      if len(filepath):
-        target_path = self.handle_directory(filepath)
+        reply = self.send(f'{command}\r\n')
 
-        if os.path.isfile(target_path):
+        if "150" in reply:
           def callback(server_socket: socket.socket):
-            print(f"\nUploading {filepath}.")
+            if offset:
+              print(f"\nResuming {filepath} from byte {offset}.")
+            else:
+              print(f"\nUploading {filepath}.")
 
-            content = ""
             with open(target_path, self.data_connection.get_read_type()) as file:
-              content = file.read()
-
-            if self.data_connection.type == "ascii":
-              content = content.encode(self.data_connection.type)
+              if self.data_connection.type == "ascii":
+                self.data_connection.send(server_socket, file.read().encode(self.data_connection.type))
+              else:
+                self.data_connection.send_file(server_socket, file, offset)
 
-            server_socket.sendall(content)
             print(f"\n{filepath} uploaded.")
-          
-          self.data_connection.handler.set_callback(callback)
 
-        else:
-          print("\nUpload failed, file not found.\n")
+          self.data_connection.handler.set_callback(callback)
+          return
 
       else:
-        print("\nUpload failed, please specify the target filename.\n")
+        print("\nUpload failed, file not found.\n")
 
-    self.data_connection.handler = None
+    else:
+      print("\nUpload failed, please specify the target filename.\n")
+
+    self.data_connection.discard()
 
   def run(self) -> None:
     if self.socket is Socket:
@@ -234,6 +296,9 @@ class FTPClient:
             elif "TYPE" in command:
               self.type(command)
 
+            elif "MODE" in command:
+              self.mode(command)
+
             elif "LIST" in command or "LS" in command:
               self.list(command)
 
@@ -244,9 +309,9 @@ class FTPClient:
               self.stor(command)
 
             else:
-              self.send(command)
+              self.send(f"{command}\r\n")
 
-            self.data_connection.run(self.socket)
+            self.data_connection.run(self.reader)
 
             if "QUIT" in command:
               break
@@ -258,5 +323,7 @@ class FTPClient:
       except KeyboardInterrupt:
         break
 
+    self.data_connection.close()
+
     print()
     self.summary()
@@ -1,35 +1,72 @@
-from threading import Thread
-from typing import Callable
+from threading import Condition, Thread, current_thread
+from typing import Callable, Iterator
+from utils import ReplyReader
 import socket
-import time
+import struct
+import zlib
+
+
+BLOCK_HEADER = struct.Struct("!BH")
+BLOCK_EOF = 64
+BLOCK_SIZE = 65535
 
 
 class DataHandler(Thread):
-  def __init__(self, data_socket: socket.socket):
+  def __init__(self, data_socket: socket.socket, connection: "DataConnection"):
     Thread.__init__(self)
 
     self.socket = data_socket
+    self.connection = connection
     
     self.callback: Callable[[socket.socket], None] = None
     self.is_running = True
 
     self.is_executed: bool = False
 
+    self.condition = Condition()
+
   def close(self) -> None:
-    self.is_running = False
+    with self.condition:
+      self.is_running = False
+      self.condition.notify_all()
   
   def set_callback(self, callback: Callable[[socket.socket], None]) -> None:
-    self.callback = callback
+    with self.condition:
+      self.callback = callback
+      self.condition.notify_all()
+
+  def wait(self) -> None:
+    with self.condition:
+      self.condition.wait_for(lambda: not self.callback or not self.is_running)
 
   def run(self):
-    while self.is_running:
-      if self.callback:
-        self.is_executed = True
+    try:
+      while True:
+        with self.condition:
+          self.condition.wait_for(lambda: self.callback or not self.is_running)
+
+          callback = self.callback
+          self.is_executed = callback is not None
+
+        if not callback:
+          return
 
-        self.callback(self.socket)
-        self.socket.close()
+        callback(self.socket)
 
-        self.callback = None
+        with self.condition:
+          self.callback = None
+          self.is_running = self.connection.mode == "B"
+          self.condition.notify_all()
+
+        if not self.is_running:
+          return
+
+    finally:
+      self.socket.close()
+
+      with self.condition:
+        self.is_running = False
+        self.condition.notify_all()
 
   @staticmethod
   def is_port_open(host, port):
@@ -41,36 +78,51 @@ class DataHandler(Thread):
     return result
 
   @staticmethod
-  def handle(command_socket: socket.socket, data_handler, callback: Callable[[], None]) -> None:
-    start_time = time.perf_counter()
+  def handle(reader: ReplyReader, data_handler, callback: Callable[[], None]) -> None:
+    data_handler.wait()
+
+    if data_handler.is_executed:
+      print(reader.read())
+
+    callback()
 
+  @staticmethod
+  def get_data(server_socket: socket.socket) -> Iterator[bytes]:
     while True:
-      if data_handler.is_executed:
-        print(command_socket.recv(1024).decode("utf-8"))
-        break
+      buffer = server_socket.recv(BLOCK_SIZE)
 
-      if time.perf_counter() - start_time > 3.0:
-        break
+      if not buffer:
+        return
 
-    callback()
+      yield buffer
 
   @staticmethod
-  def get_data(server_socket: socket.socket) -> bytes:
+  def read_exactly(server_socket: socket.socket, size: int) -> bytes:
     data = b""
-    while True:
-      buffer = server_socket.recv(1024)
+    while len(data) < size:
+      buffer = server_socket.recv(size - len(data))
+      if not buffer:
+        raise ConnectionError("Data connection closed inside a block.")
 
-      if buffer:
-        data += buffer
-      else:
-        break
+      data += buffer
 
     return data
 
+  @staticmethod
+  def get_blocks(server_socket: socket.socket) -> Iterator[bytes]:
+    while True:
+      descriptor, size = BLOCK_HEADER.unpack(DataHandler.read_exactly(server_socket, BLOCK_HEADER.size))
+      yield DataHandler.read_exactly(server_socket, size)
+
+      if descriptor & BLOCK_EOF:
+        return
+
 
 class DataConnection:
   def __init__(self) -> None:
     self.type = "ascii"
+    self.mode = "S"
+    self.level = 6
     self.handler: DataHandler = None
     self.executor: Thread = None
 
@@ -86,6 +138,75 @@ class DataConnection:
     elif self.type == "ascii":
       return "w"
 
+  def chunks(self, server_socket: socket.socket) -> Iterator[bytes]:
+    if self.mode == "B":
+      yield from DataHandler.get_blocks(server_socket)
+      return
+
+    if self.mode != "Z":
+      yield from DataHandler.get_data(server_socket)
+      return
+
+    decompressor = zlib.decompressobj()
+    for chunk in DataHandler.get_data(server_socket):
+      data = decompressor.decompress(chunk)
+      if data:
+        yield data
+
+    data = decompressor.flush()
+    if data:
+      yield data
+
+    if not decompressor.eof:
+      raise zlib.error("Data connection closed inside a compressed stream.")
+
+  def receive(self, server_socket: socket.socket) -> bytes:
+    return b"".join(self.chunks(server_socket))
+
+  def send(self, server_socket: socket.socket, data: bytes) -> None:
+    if self.mode == "Z":
+      data = zlib.compress(data, self.level)
+
+    if self.mode == "B":
+      for index in range(0, len(data), BLOCK_SIZE):
+        block = data[index:index + BLOCK_SIZE]
+        server_socket.sendall(BLOCK_HEADER.pack(0, len(block)) + block)
+
+      server_socket.sendall(BLOCK_HEADER.pack(BLOCK_EOF, 0))
+      return
+
+    server_socket.sendall(data)
+
+  def send_file(self, server_socket: socket.socket, file, offset: int = 0) -> None:
+    if self.mode == "B":
+      file.seek(offset)
+
+      while True:
+        block = file.read(BLOCK_SIZE)
+        if not block:
+          break
+
+        server_socket.sendall(BLOCK_HEADER.pack(0, len(block)) + block)
+
+      server_socket.sendall(BLOCK_HEADER.pack(BLOCK_EOF, 0))
+      return
+
+    if self.mode != "Z":
+      server_socket.sendfile(file, offset)
+      return
+
+    compressor = zlib.compressobj(self.level)
+    file.seek(offset)
+
+    while True:
+      data = file.read(64 * 1024)
+      if not data:
+        break
+
+      server_socket.sendall(compressor.compress(data))
+
+    server_socket.sendall(compressor.flush())
+
   def set_handler(self, handler: DataHandler) -> None:
     self.handler = handler
     self.handler.start()
@@ -104,8 +225,26 @@ class DataConnection:
       self.handler = None
 
     self.executor = None
+
+  def finish(self) -> None:
+    if self.handler and self.handler.is_running:
+      self.executor = None
+    else:
+      self.close()
+
+  def discard(self) -> None:
+    if self.mode != "B":
+      self.close()
+
+  def is_idle(self) -> bool:
+    return bool(self.handler and self.handler.is_running and not self.executor)
   
-  def run(self, command_socket: socket.socket) -> None:
+  def wait(self) -> None:
+    executor = self.executor
+    if executor and executor is not current_thread():
+      executor.join()
+
+  def run(self, reader: ReplyReader) -> None:
     if self.handler and self.handler.callback and not self.executor:
-      self.executor = Thread(target=DataHandler.handle, args=(command_socket, self.handler, self.close))
+      self.executor = Thread(target=DataHandler.handle, args=(reader, self.handler, self.finish))
       self.executor.start()
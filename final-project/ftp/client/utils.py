@@ -1,3 +1,4 @@
+from threading import Lock
 import socket
 
 
@@ -27,6 +28,36 @@ class Socket:
     return self.socket
 
 
+class ReplyReader:
+  def __init__(self, command_socket: socket.socket) -> None:
+    self.socket = command_socket
+    self.buffer = b""
+    self.lock = Lock()
+
+  def read_line(self) -> str:
+    while b"\r\n" not in self.buffer:
+      data = self.socket.recv(1024)
+      if not data:
+        line, self.buffer = self.buffer, b""
+        return line.decode("utf-8")
+
+      self.buffer += data
+
+    line, self.buffer = self.buffer.split(b"\r\n", 1)
+    return line.decode("utf-8") + "\r\n"
+
+  def read(self) -> str:
+    with self.lock:
+      reply = line = self.read_line()
+
+      if line[3:4] == "-":
+        while line and not line.startswith(f"{reply[:3]} "):
+          line = self.read_line()
+          reply += line
+
+      return reply
+
+
 class Input:
   @staticmethod
   def get_input_by_confirm(confirm, determine, default = ""):
@@ -0,0 +1,121 @@
+from typing import Optional, Tuple
+from utils import Path
+from vfs import FileSystem, LocalFileSystem, is_plain
+import io
+import os
+import shutil
+import stat
+import tarfile
+import time
+import zipfile
+
+
+class StreamWriter(io.RawIOBase):
+  def __init__(self, stream) -> None:
+    self.stream = stream
+
+  def writable(self) -> bool:
+    return True
+
+  def write(self, data) -> int:
+    self.stream.sendall(data)
+    return len(data)
+
+
+class Archive:
+  FORMATS = (".tar", ".zip")
+
+  def __init__(self, directory: str, format: str, level: int = 6, stored_extensions: Tuple[str, ...] = (), \
+    filesystem: Optional[FileSystem] = None) -> None:
+    self.directory = directory
+    self.format = format
+    self.level = level
+    self.stored_extensions = stored_extensions
+    self.filesystem = filesystem or LocalFileSystem()
+
+  @staticmethod
+  def target(filepath: str, root: str, filesystem: FileSystem) -> Optional[Tuple[str, str]]:
+    directory, format = os.path.splitext(filepath)
+
+    if format.lower() not in Archive.FORMATS or filesystem.exists(filepath) or not filesystem.isdir(directory):
+      return None
+
+    # The walk follows a linked directory, so its resolved location must lie inside the root as well.
+    if Path.is_inside(filesystem.realpath(root), filesystem.realpath(directory)):
+      return directory, format.lower()
+
+    return None
+
+  def entries(self):
+    prefix = os.path.basename(os.path.normpath(self.directory))
+
+    for dirpath, dirnames, filenames in self.filesystem.walk(self.directory):
+      dirnames.sort()
+      relative = os.path.relpath(dirpath, self.directory)
+      arcdir = prefix if relative == "." else os.path.join(prefix, relative)
+
+      yield dirpath, arcdir
+
+      for filename in sorted(filenames):
+        yield os.path.join(dirpath, filename), os.path.join(arcdir, filename)
+
+  def write_tar(self, output: io.BufferedWriter, chunk_size: int) -> None:
+    with tarfile.open(fileobj=output, mode="w|", format=tarfile.PAX_FORMAT, bufsize=chunk_size) as archive:
+      for path, arcname in self.entries():
+        stats = self.filesystem.lstat(path)
+
+        info = tarfile.TarInfo(arcname)
+        info.mode = stat.S_IMODE(stats.st_mode)
+        info.uid, info.gid = stats.st_uid, stats.st_gid
+        info.mtime = stats.st_mtime
+
+        if stat.S_ISDIR(stats.st_mode):
+          info.type = tarfile.DIRTYPE
+          archive.addfile(info)
+
+        elif stat.S_ISLNK(stats.st_mode):
+          info.type = tarfile.SYMTYPE
+          info.linkname = self.filesystem.readlink(path)
+          archive.addfile(info)
+
+        elif stat.S_ISREG(stats.st_mode):
+          info.size = stats.st_size
+
+          with self.filesystem.open(path, "rb") as file:
+            archive.addfile(info, file)
+
+  def write_zip(self, output: io.BufferedWriter, chunk_size: int) -> None:
+    with zipfile.ZipFile(output, "w", zipfile.ZIP_DEFLATED, compresslevel=self.level) as archive:
+      for path, arcname in self.entries():
+        stats = self.filesystem.lstat(path)
+
+        # Zip has no portable timestamps before 1980.
+        info = zipfile.ZipInfo(arcname, max(time.localtime(stats.st_mtime)[:6], (1980, 1, 1, 0, 0, 0)))
+        info.external_attr = (stats.st_mode & 0xFFFF) << 16
+
+        if not is_plain(stats):
+          continue
+
+        if stat.S_ISDIR(stats.st_mode):
+          info.filename += "/"
+          info.external_attr |= 0x10
+          archive.writestr(info, b"")
+
+        else:
+          stored = path.lower().endswith(self.stored_extensions)
+          info.compress_type = zipfile.ZIP_STORED if stored else zipfile.ZIP_DEFLATED
+          info._compresslevel = self.level
+          info.file_size = stats.st_size
+
+          with self.filesystem.open(path, "rb") as file, archive.open(info, "w") as entry:
+            shutil.copyfileobj(file, entry, chunk_size)
+
+  def write(self, stream, chunk_size: int = 64 * 1024) -> None:
+    output = io.BufferedWriter(StreamWriter(stream), chunk_size)
+
+    if self.format == ".tar":
+      self.write_tar(output, chunk_size)
+    else:
+      self.write_zip(output, chunk_size)
+
+    output.flush()
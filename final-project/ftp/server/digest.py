@@ -0,0 +1,122 @@
+from collections import OrderedDict
+from threading import Lock
+from typing import Callable, Dict, Optional, Tuple
+from vfs import FileSystem, LocalFileSystem, is_settled
+import hashlib
+import json
+import os
+import zlib
+
+
+class CRC32:
+  def __init__(self) -> None:
+    self.value = 0
+
+  def update(self, data: bytes) -> None:
+    self.value = zlib.crc32(data, self.value)
+
+  def hexdigest(self) -> str:
+    return f"{self.value:08x}"
+
+
+class DigestCache:
+  ALGORITHMS: Dict[str, Callable] = {
+    "SHA-256": hashlib.sha256,
+    "SHA-1": hashlib.sha1,
+    "MD5": hashlib.md5,
+    "CRC32": CRC32,
+  }
+
+  def __init__(self, filepath: str = "", capacity: int = 4096, chunk_size: int = 1024 * 1024, \
+    filesystem: Optional[FileSystem] = None) -> None:
+    self.filepath = filepath
+    self.capacity = capacity
+    self.chunk_size = chunk_size
+    self.filesystem = filesystem or LocalFileSystem()
+
+    self.entries: "OrderedDict[Tuple, str]" = OrderedDict()
+    self.lock = Lock()
+
+    self.load()
+
+  def load(self) -> None:
+    if not self.filepath or not os.path.isfile(self.filepath):
+      return
+
+    lines = 0
+    with open(self.filepath, "r") as file:
+      for line in file:
+        lines += 1
+
+        try:
+          record = json.loads(line)
+          key = tuple(record["key"])
+
+          self.entries[key] = record["digest"]
+          self.entries.move_to_end(key)
+        except (ValueError, KeyError, TypeError):
+          continue
+
+    while len(self.entries) > self.capacity:
+      self.entries.popitem(last=False)
+
+    if lines > len(self.entries):
+      temporary = f"{self.filepath}.{os.getpid()}.tmp"
+
+      with open(temporary, "w") as file:
+        for key, digest in self.entries.items():
+          file.write(json.dumps({"key": list(key), "digest": digest}) + "\n")
+
+      os.replace(temporary, self.filepath)
+
+  def save(self, key: Tuple, digest: str) -> None:
+    if not self.filepath:
+      return
+
+    try:
+      with open(self.filepath, "a") as file:
+        file.write(json.dumps({"key": list(key), "digest": digest}) + "\n")
+    except OSError:
+      pass
+
+  def compute(self, path: str, algorithm: str, start: int, end: int) -> str:
+    digest = DigestCache.ALGORITHMS[algorithm]()
+
+    with self.filesystem.open(path, "rb") as file:
+      file.seek(start)
+      remaining = end - start
+
+      while remaining > 0:
+        data = file.read(min(self.chunk_size, remaining))
+        if not data:
+          break
+
+        digest.update(data)
+        remaining -= len(data)
+
+    return digest.hexdigest()
+
+  def digest(self, path: str, algorithm: str, start: int = 0, end: Optional[int] = None) -> Tuple[str, bool]:
+    stats = self.filesystem.stat(path)
+    end = stats.st_size if end is None else min(end, stats.st_size)
+
+    key = (self.filesystem.realpath(path), stats.st_ino, stats.st_size, stats.st_mtime_ns, algorithm, start, end)
+
+    with self.lock:
+      digest = self.entries.get(key)
+      if digest:
+        self.entries.move_to_end(key)
+        return digest, True
+
+    digest = self.compute(path, algorithm, start, end)
+
+    if is_settled(stats):
+      with self.lock:
+        self.entries[key] = digest
+
+        while len(self.entries) > self.capacity:
+          self.entries.popitem(last=False)
+
+      self.save(key, digest)
+
+    return digest, False
@@ -0,0 +1,95 @@
+from metrics import Metrics
+from threading import Condition, Event, Thread
+from typing import BinaryIO, Callable, Dict, List, Optional
+from vfs import FileSystem
+import time
+
+
+class SyncRequest:
+  def __init__(self, action: Callable[[], None], key: Optional[tuple] = None) -> None:
+    self.action = action
+    self.key = key
+
+    self.error: Optional[OSError] = None
+    self.event = Event()
+
+  def wait(self) -> None:
+    self.event.wait()
+
+    if self.error:
+      raise self.error
+
+
+class Durability:
+  POLICIES = ("none", "fsync", "group")
+
+  def __init__(self, policy: str = "none", window: float = 0.0, metrics: Optional[Metrics] = None) -> None:
+    if policy not in Durability.POLICIES:
+      raise ValueError(f"Unknown durability policy: {policy}")
+
+    self.policy = policy
+    self.window = window
+    self.metrics = metrics
+
+    self.pending: List[SyncRequest] = []
+    self.condition = Condition()
+
+    if policy == "group":
+      Thread(target=self.commit, daemon=True).start()
+
+  def count(self, name: str, value: int) -> None:
+    if self.metrics and value:
+      self.metrics.add(name, value)
+
+  def sync(self, filesystem: FileSystem, file: BinaryIO) -> None:
+    self.submit(SyncRequest(lambda: filesystem.fsync(file)))
+
+  def sync_directory(self, filesystem: FileSystem, path: str) -> None:
+    self.submit(SyncRequest(lambda: filesystem.fsync_directory(path), (id(filesystem), path)))
+
+  def submit(self, request: SyncRequest) -> None:
+    if self.policy == "none":
+      return
+
+    # File syncs run in the uploading session's own thread, so concurrent uploads flush in parallel.
+    if self.policy == "fsync" or request.key is None:
+      request.action()
+      self.count("ftp_fsync_total", 1)
+      return
+
+    with self.condition:
+      self.pending.append(request)
+      self.condition.notify()
+
+    request.wait()
+
+  def commit(self) -> None:
+    while True:
+      with self.condition:
+        while not self.pending:
+          self.condition.wait()
+
+      # Requests arriving while a batch syncs form the next one; a window only helps on very slow disks.
+      if self.window:
+        time.sleep(self.window)
+
+      with self.condition:
+        batch, self.pending = self.pending, []
+
+      # Every request in the batch was queued after its own rename, so one directory sync covers them all.
+      synced: Dict[tuple, Optional[OSError]] = {}
+
+      for request in batch:
+        if request.key not in synced:
+          try:
+            request.action()
+            self.count("ftp_fsync_total", 1)
+          except OSError as e:
+            request.error = e
+
+          synced[request.key] = request.error
+
+        request.error = synced[request.key]
+        request.event.set()
+
+      self.count("ftp_fsync_batches_total", 1)
@@ -0,0 +1,63 @@
+from collections import OrderedDict
+from threading import Lock
+from typing import Optional, Tuple
+from vfs import FileSystem, LocalFileSystem, is_settled
+
+
+class FileCache:
+  def __init__(self, capacity: int = 64 * 1024 * 1024, max_file_size: int = 256 * 1024, \
+    filesystem: Optional[FileSystem] = None) -> None:
+    self.capacity = capacity
+    self.max_file_size = min(max_file_size, capacity)
+    self.filesystem = filesystem or LocalFileSystem()
+
+    self.entries: "OrderedDict[str, Tuple[int, int, bytes]]" = OrderedDict()
+    self.size = 0
+    self.lock = Lock()
+
+  def invalidate(self, path: str) -> None:
+    path = self.filesystem.realpath(path)
+
+    with self.lock:
+      entry = self.entries.pop(path, None)
+      if entry:
+        self.size -= len(entry[2])
+
+  def get(self, path: str) -> Tuple[Optional[bytes], bool]:
+    if not self.max_file_size:
+      return None, False
+
+    stats = self.filesystem.stat(path)
+    if stats.st_size > self.max_file_size:
+      return None, False
+
+    key = self.filesystem.realpath(path)
+    with self.lock:
+      entry = self.entries.get(key)
+      if entry and entry[0] == stats.st_mtime_ns and entry[1] == stats.st_size:
+        self.entries.move_to_end(key)
+        return entry[2], True
+
+    with self.filesystem.open(path, "rb") as file:
+      content = file.read(self.max_file_size + 1)
+      stats = self.filesystem.stat(path)
+
+    if len(content) != stats.st_size:
+      return None, False
+
+    if not is_settled(stats):
+      return content, False
+
+    with self.lock:
+      entry = self.entries.pop(key, None)
+      if entry:
+        self.size -= len(entry[2])
+
+      self.entries[key] = (stats.st_mtime_ns, stats.st_size, content)
+      self.size += len(content)
+
+      while self.size > self.capacity:
+        _, (_, _, evicted) = self.entries.popitem(last=False)
+        self.size -= len(evicted)
+
+    return content, False
@@ -1,24 +1,212 @@
-from handler import CommandHandler
-from typing import List
-from utils import Socket
+from concurrent.futures import ThreadPoolExecutor
+from digest import DigestCache
+from durability import Durability
+from filecache import FileCache
+from handler import AsyncCommandHandler, CommandHandler
+from listing import Listing
+from logger import logger
+from metrics import CommandStats, Metrics, MetricsExporter
+from statcache import StatCache
+from throttle import Bandwidth
+from threading import Lock, Thread
+from typing import Callable, Dict, List, Optional
+from users import PasswordHash, User, UserStore
+from utils import PortPool, Reply, Socket
+from vfs import FileSystem, LocalFileSystem, MemoryFileSystem, OverlayFileSystem
+import asyncio
 import select
+import signal
+import socket
+import time
+
+
+class Admission:
+  def __init__(self, max_sessions: int = 0, max_sessions_per_ip: int = 0) -> None:
+    self.max_sessions = max_sessions
+    self.max_sessions_per_ip = max_sessions_per_ip
+
+    self.sessions = 0
+    self.addresses: Dict[str, int] = {}
+    self.lock = Lock()
+
+  def acquire(self, address: str) -> Optional[Reply]:
+    with self.lock:
+      if self.max_sessions and self.sessions >= self.max_sessions:
+        return Reply(421, "There are too many connected users, please try later.")
+
+      if self.max_sessions_per_ip and self.addresses.get(address, 0) >= self.max_sessions_per_ip:
+        return Reply(421, "There are too many connections from your internet address.")
+
+      self.sessions += 1
+      self.addresses[address] = self.addresses.get(address, 0) + 1
+
+    return None
+
+  def release(self, address: str) -> None:
+    with self.lock:
+      self.sessions -= 1
+      self.addresses[address] -= 1
+
+      if not self.addresses[address]:
+        del self.addresses[address]
 
 
 class FTPServer:
-  def __init__(self, config: dict) -> None:
+  # Keys that are only read at startup; changing them needs a hand-off to a new process.
+  STATIC = (
+    'host', 'port', 'root', 'mode', 'workers', 'filesystem', 'memory_fs_size', 'overlay_max_file',
+    'transfer_workers', 'control_workers', 'auth_workers', 'digest_cache', 'stor_durability', 'stor_group_window',
+    'metrics_host', 'metrics_port', 'metrics_file', 'metrics_interval',
+    'log_level', 'log_format', 'log_file', 'log_sample', 'log_queue_size'
+  )
+
+  DRAIN_GRACE = 1.0
+
+  def __init__(self, config: dict, loader: Optional[Callable[[], dict]] = None) -> None:
     self.socket = Socket(config['host'], int(config['port']))
 
+    self.config = config
+    self.loader = loader
+
     self.host = config['host']
-    self.user = config['user']
-    self.passwd = config['password']
     self.root = config['root']
 
+    self.admission = Admission()
+    self.users = UserStore(int(config.get('auth_workers', 4)))
+
+    self.filesystem = self.create_filesystem(config)
+
+    self.stat_cache = StatCache(filesystem=self.filesystem)
+    self.listing = Listing(stat_cache=self.stat_cache, filesystem=self.filesystem)
+    self.files = FileCache(filesystem=self.filesystem)
+    self.digests = DigestCache(
+      config.get('digest_cache', ''),
+      int(config.get('digest_cache_size', 4096)),
+      filesystem=self.filesystem
+    )
+    self.stats = CommandStats()
+    self.metrics = Metrics(self.stats)
+
+    self.durability = Durability(
+      config.get('stor_durability', 'none'),
+      float(config.get('stor_group_window', 0)),
+      self.metrics
+    )
+
+    self.exporter = MetricsExporter(
+      self.metrics,
+      config.get('metrics_host', '127.0.0.1'),
+      int(config.get('metrics_port', 0)),
+      config.get('metrics_file', ''),
+      float(config.get('metrics_interval', 15))
+    )
+
+    self.bandwidth = Bandwidth()
+
+    self.pool = PortPool(
+      self.host,
+      int(config.get('pasv_min_port', 60001)),
+      int(config.get('pasv_max_port', 65535))
+    )
+
     self.threads: List[CommandHandler] = []
+    self.lock = Lock()
+
+    self.is_draining = False
+    self.wakeup, self.waker = socket.socketpair()
+
+    self.configure(config)
 
   def __del__(self):
     self.socket.close()
 
-  def connect(self) -> bool:
+  def configure(self, config: dict) -> None:
+    # Components are updated in place because every session holds references to them.
+    if config.get('users_file'):
+      self.users.load(config['users_file'])
+    elif config.get('user'):
+      self.users.replace([User(config['user'], PasswordHash.create(config.get('password', '')))])
+
+    self.users.cache_ttl = float(config.get('auth_cache_ttl', 60))
+    self.users.cache_size = int(config.get('auth_cache_size', 4096))
+
+    self.buffer_size = int(config.get('buffer_size', 256 * 1024))
+
+    self.zlib_level = int(config.get('zlib_level', 6))
+    self.compressed_extensions = tuple(
+      extension.strip().lower()
+      for extension in config.get('zlib_skip', '.jpg,.jpeg,.png,.gif,.mp3,.mp4,.zip,.gz,.bz2,.xz').split(',')
+      if extension.strip()
+    )
+
+    self.idle_timeout = float(config.get('idle_timeout', 300)) or None
+    self.data_timeout = float(config.get('data_timeout', 60)) or None
+    self.drain_timeout = float(config.get('drain_timeout', 300))
+
+    self.admission.max_sessions = int(config.get('max_sessions', 0))
+    self.admission.max_sessions_per_ip = int(config.get('max_sessions_per_ip', 0))
+
+    self.stat_cache.ttl = float(config.get('stat_cache_ttl', 1.0))
+    self.stat_cache.capacity = int(config.get('stat_cache_size', 4096))
+    self.listing.capacity = int(config.get('listing_cache_size', 256))
+    self.files.capacity = int(config.get('file_cache_size', 64 * 1024 * 1024))
+    self.files.max_file_size = min(int(config.get('file_cache_max_file', 256 * 1024)), self.files.capacity)
+    self.digests.capacity = int(config.get('digest_cache_size', 4096))
+
+    self.bandwidth.configure(
+      int(config.get('rate_limit', 0)),
+      int(config.get('session_rate_limit', 0)),
+      int(config.get('user_rate_limit', 0))
+    )
+
+    self.pool.configure(
+      int(config.get('pasv_min_port', 60001)),
+      int(config.get('pasv_max_port', 65535))
+    )
+
+  def reload(self) -> None:
+    try:
+      config = self.loader()
+      self.configure(config)
+
+    except Exception as e:
+      logger.error("reload_failed", error=str(e))
+      return
+
+    changed = [key for key in FTPServer.STATIC if config.get(key) != self.config.get(key)]
+    if changed:
+      logger.warning("restart_required", keys=",".join(changed))
+
+    self.config = config
+    logger.info("config_reloaded", users=len(self.users.users))
+
+  def create_filesystem(self, config: dict) -> FileSystem:
+    kind = config.get('filesystem', 'local')
+    local = LocalFileSystem()
+
+    if kind == 'local':
+      return local
+
+    memory = MemoryFileSystem(int(config.get('memory_fs_size', 256 * 1024 * 1024)))
+
+    if kind == 'memory':
+      memory.load(self.root, local)
+      return memory
+
+    if kind == 'overlay':
+      return OverlayFileSystem(local, memory, int(config.get('overlay_max_file', 16 * 1024 * 1024)))
+
+    raise ValueError(f"Unknown filesystem: {kind}")
+
+  def connect(self, listener: Optional[socket.socket] = None) -> bool:
+    listener = listener or Socket.inherited()
+
+    if listener:
+      self.socket.get().close()
+      self.socket = listener
+
+      return True
+
     if self.socket.connect(100):
       self.socket = self.socket.get()
 
@@ -26,30 +214,248 @@ class FTPServer:
     
     return False
 
+  def admit(self, client_socket: socket.socket, address: str) -> bool:
+    reply = self.admission.acquire(address)
+
+    if reply:
+      self.metrics.add("ftp_sessions_rejected_total", 1)
+      logger.warning("session_rejected", address=address, reply=reply.code)
+
+      try:
+        client_socket.sendall(reply.get().encode("utf-8"))
+      except OSError:
+        pass
+
+      client_socket.close()
+      return False
+
+    self.metrics.add("ftp_sessions_total", 1)
+    self.metrics.add("ftp_sessions_active", 1)
+    return True
+
+  def release(self, client: CommandHandler) -> None:
+    self.admission.release(client.address)
+    self.metrics.add("ftp_sessions_active", -1)
+
+    with self.lock:
+      if client in self.threads:
+        self.threads.remove(client)
+
+  def reap(self) -> None:
+    while True:
+      time.sleep(max(1.0, (self.idle_timeout or 60) / 4))
+
+      with self.lock:
+        self.threads = [client for client in self.threads if client.is_alive()]
+        idle_clients = [client for client in self.threads if client.is_idle()]
+
+      for client in idle_clients:
+        client.send_timeout()
+        client.close()
+
+  def dump_stats(self, *_) -> None:
+    for line in self.stats.dump():
+      logger.info("command_latency", stats=line)
+
+  def request_reload(self, *_) -> None:
+    if self.loader:
+      # Password hashing for the conf user makes a reload too slow for the signal handler.
+      Thread(target=self.reload, daemon=True).start()
+
+  def handoff(self, *_) -> None:
+    if self.is_draining:
+      return
+
+    # Prefork workers only drain; the supervisor starts the successor.
+    if 'worker' not in self.config:
+      try:
+        logger.info("handoff_started", successor=Socket.handoff(self.socket))
+      except OSError as e:
+        logger.error("handoff_failed", error=str(e))
+        return
+
+    self.stop()
+
+  def stop(self) -> None:
+    self.is_draining = True
+    self.waker.send(b"\0")
+
+  def handle_signals(self) -> None:
+    if hasattr(signal, 'SIGUSR1'):
+      signal.signal(signal.SIGUSR1, self.dump_stats)
+    if hasattr(signal, 'SIGHUP'):
+      signal.signal(signal.SIGHUP, self.request_reload)
+    if hasattr(signal, 'SIGUSR2'):
+      signal.signal(signal.SIGUSR2, self.handoff)
+
+  def drain(self) -> None:
+    with self.lock:
+      threads = list(self.threads)
+
+    logger.info("server_draining", sessions=len(threads), timeout=self.drain_timeout)
+    deadline = time.monotonic() + self.drain_timeout
+
+    # Sessions between transfers are told to reconnect; running transfers get until the deadline.
+    while time.monotonic() < deadline:
+      threads = [client for client in threads if client.is_alive()]
+      if not threads:
+        break
+
+      for client in threads:
+        if client.is_idle(FTPServer.DRAIN_GRACE):
+          client.shutdown()
+
+      time.sleep(0.1)
+
+    for client in threads:
+      if client.is_alive():
+        logger.info("session_dropped", thread=client.getName(), peer=client.peer)
+        client.close()
+      client.join()
+
   def run(self) -> None:
     if self.socket is Socket:
       return
 
-    while True:
+    self.handle_signals()
+    self.exporter.start()
+
+    Thread(target=self.reap, daemon=True).start()
+
+    # Workers may share the listener, so another process can win the accept.
+    self.socket.setblocking(False)
+
+    while not self.is_draining:
       try:
-        read_ready_sockets, _, _ = select.select([self.socket], [], [])
+        read_ready_sockets, _, _ = select.select([self.socket, self.wakeup], [], [])
 
         for ready_socket in read_ready_sockets:
           if ready_socket == self.socket:
-            client_socket, _ = self.socket.accept()
+            try:
+              client_socket, address = self.socket.accept()
+            except OSError:
+              continue
+
+            # A client may reset the connection before it is served; that must only cost its own socket.
+            try:
+              client_socket.setblocking(True)
+              client_socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+              if not self.admit(client_socket, address[0]):
+                continue
 
-            client = CommandHandler(self.host, client_socket, self.root, self.user, self.passwd)
+            except OSError:
+              client_socket.close()
+              continue
+
+            client = CommandHandler(self, client_socket, address)
+            with self.lock:
+              self.threads.append(client)
             client.start()
-            self.threads.append(client)
 
       except KeyboardInterrupt:
         break
 
-    print("\nClosing the server.")
+    logger.info("server_closing")
     self.socket.close()
 
-    print("Checking the connected clients by threads.")
-    for client in self.threads:
-      if client.is_alive():
-        print(client.getName(), "is still alive")
-      client.join()
+    self.drain()
+    logger.flush()
+
+
+class AsyncFTPServer(FTPServer):
+  def __init__(self, config: dict, loader: Optional[Callable[[], dict]] = None) -> None:
+    FTPServer.__init__(self, config, loader)
+
+    self.executor = ThreadPoolExecutor(max_workers=int(config.get('transfer_workers', 32)))
+
+    # Blocking control commands get their own threads, so logins never queue behind long transfers.
+    self.control_executor = ThreadPoolExecutor(
+      max_workers=int(config.get('control_workers', 8)),
+      thread_name_prefix="control"
+    )
+    self.sessions: Dict[asyncio.Task, AsyncCommandHandler] = {}
+
+    self.loop: asyncio.AbstractEventLoop = None
+    self.stopping: asyncio.Event = None
+
+  async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+    address = writer.get_extra_info("peername")[0]
+    writer.get_extra_info("socket").setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    reply = self.admission.acquire(address)
+    if reply:
+      self.metrics.add("ftp_sessions_rejected_total", 1)
+      logger.warning("session_rejected", address=address, reply=reply.code)
+
+      writer.write(reply.get().encode("utf-8"))
+      writer.close()
+      return
+
+    self.metrics.add("ftp_sessions_total", 1)
+    self.metrics.add("ftp_sessions_active", 1)
+
+    client = AsyncCommandHandler(self, reader, writer)
+
+    task = asyncio.current_task()
+    self.sessions[task] = client
+
+    try:
+      await client.run()
+    finally:
+      self.sessions.pop(task, None)
+      self.admission.release(address)
+      self.metrics.add("ftp_sessions_active", -1)
+
+  def stop(self) -> None:
+    self.is_draining = True
+
+    if self.loop:
+      self.loop.call_soon_threadsafe(self.stopping.set)
+
+  async def drain(self) -> None:
+    logger.info("server_draining", sessions=len(self.sessions), timeout=self.drain_timeout)
+    deadline = time.monotonic() + self.drain_timeout
+
+    while self.sessions and time.monotonic() < deadline:
+      for client in list(self.sessions.values()):
+        if client.is_idle(FTPServer.DRAIN_GRACE):
+          client.shutdown()
+
+      await asyncio.sleep(0.1)
+
+    for task in list(self.sessions):
+      task.cancel()
+
+  async def serve(self) -> None:
+    self.loop = asyncio.get_running_loop()
+    self.stopping = asyncio.Event()
+    if self.is_draining:
+      self.stopping.set()
+
+    server = await asyncio.start_server(self.handle, sock=self.socket)
+
+    await self.stopping.wait()
+    server.close()
+
+    await self.drain()
+
+  def run(self) -> None:
+    if self.socket is Socket:
+      return
+
+    self.handle_signals()
+    self.exporter.start()
+
+    try:
+      asyncio.run(self.serve())
+
+    except KeyboardInterrupt:
+      pass
+
+    logger.info("server_closing", dropped=len(self.sessions))
+    self.socket.close()
+
+    self.executor.shutdown(wait=True)
+    self.control_executor.shutdown(wait=True)
+    logger.flush()
@@ -1,83 +1,185 @@
-from random import randint
-from threading import Thread
-from typing import Callable, List, Optional
-from utils import Path, Reply, Socket
+from archive import Archive
+from concurrent.futures import Executor
+from digest import DigestCache
+from durability import Durability
+from filecache import FileCache
+from listing import Listing
+from logger import logger
+from metrics import CommandStats, Metrics
+from statcache import StatCache
+from stream import BlockStream, DataStream, DeflateStream
+from throttle import Bandwidth, Throttle
+from threading import Condition, Thread
+from typing import Callable, List, Optional, Tuple, TYPE_CHECKING
+from users import User, UserStore
+from utils import LineReader, Path, PortPool, Reply
+from vfs import FileSystem
+import asyncio
+import codecs
 import os
+import posixpath
 import socket
+import stat
 import time
 
 
+if TYPE_CHECKING:
+  from ftp import FTPServer
+
+
+CHUNK_SIZE = 64 * 1024
+
+
 class DataHandler(Thread):
-  def __init__(self, data_socket: socket.socket):
+  def __init__(self, data_socket: socket.socket, connection: "DataConnection"):
     Thread.__init__(self)
 
     self.socket = data_socket
+    self.socket.settimeout(connection.timeout)
+    self.connection = connection
     
     self.client_socket: socket.socket = None
+    self.command_socket: socket.socket = None
 
-    self.callback: Callable[[socket.socket], Reply] = None
+    self.callback: Callable[[DataStream], Reply] = None
     self.is_running = True
 
-    self.reply: Reply = None
-
-  def __del__(self) -> None:
-    self.socket.close()
+    self.condition = Condition()
 
   def close(self) -> None:
-    self.is_running = False
+    with self.condition:
+      self.is_running = False
+      self.condition.notify_all()
+
+    try:
+      self.socket.shutdown(socket.SHUT_RDWR)
+    except OSError:
+      pass
   
-  def set_callback(self, callback: Callable[[socket.socket], Reply]) -> None:
-    self.callback = callback
+  def set_callback(self, callback: Callable[[DataStream], Reply]) -> None:
+    with self.condition:
+      self.callback = callback
+
+  def start_transfer(self, command_socket: socket.socket) -> None:
+    with self.condition:
+      self.command_socket = command_socket
+      self.condition.notify_all()
+
+  def wait(self) -> None:
+    with self.condition:
+      self.condition.wait_for(lambda: not self.command_socket or not self.is_running)
 
   def run(self):
-    while self.is_running:
-      if not self.client_socket:
+    try:
+      try:
         self.client_socket, _ = self.socket.accept()
-      
-      if self.callback:
-        self.reply = self.callback(self.client_socket)
+        self.client_socket.settimeout(self.connection.timeout)
+      except OSError:
+        pass
+
+      while True:
+        with self.condition:
+          self.condition.wait_for(lambda: self.command_socket or not self.is_running)
+
+          if not self.command_socket:
+            return
+
+        if self.client_socket:
+          reply = self.connection.transfer(self.callback, self.client_socket)
+        else:
+          reply = Reply(425, "Can't open data connection.")
+
+        self.command_socket.sendall(reply.get().encode("utf-8"))
+
+        if not self.connection.keeps_alive(reply):
+          return
+
+        with self.condition:
+          self.command_socket = None
+          self.callback = None
+          self.condition.notify_all()
+
+    except OSError:
+      pass
+
+    finally:
+      if self.client_socket:
         self.client_socket.close()
 
-        self.callback = None
+      self.connection.pool.release(self.socket)
 
-  @staticmethod
-  def is_port_open(host, port):
-    data_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+      with self.condition:
+        self.is_running = False
+        self.condition.notify_all()
 
-    result = data_socket.connect_ex((host, port))
-    data_socket.close()
 
-    return result
+class AsyncDataHandler:
+  def __init__(self, data_socket: socket.socket, connection: "AsyncDataConnection"):
+    self.socket = data_socket
+    self.socket.setblocking(False)
+    self.connection = connection
 
-  @staticmethod
-  def handle(command_socket: socket.socket, data_handler, callback: Callable[[], None]) -> None:
-    start_time = time.perf_counter()
+    self.client_socket: socket.socket = None
+    self.callback: Callable[[DataStream], Reply] = None
 
-    while True:
-      reply = data_handler.reply
-      if reply:
-        command_socket.sendall(reply.get().encode("utf-8"))
-        break
+  def set_callback(self, callback: Callable[[DataStream], Reply]) -> None:
+    self.callback = callback
 
-      if time.perf_counter() - start_time > 3.0:
-        break
-    
-    callback()
+  def close(self) -> None:
+    if self.client_socket:
+      self.client_socket.close()
+      self.client_socket = None
+
+    self.connection.pool.release(self.socket)
+
+  async def handle(self, writer: asyncio.StreamWriter) -> None:
+    loop = asyncio.get_running_loop()
+    reply = None
+
+    try:
+      try:
+        if not self.client_socket:
+          self.client_socket, _ = await asyncio.wait_for(loop.sock_accept(self.socket), self.connection.timeout)
+          self.client_socket.settimeout(self.connection.timeout)
+
+      except asyncio.TimeoutError:
+        reply = Reply(425, "Can't open data connection.")
+
+      else:
+        reply = await loop.run_in_executor(
+          self.connection.executor, self.connection.transfer, self.callback, self.client_socket
+        )
+
+      writer.write(reply.get().encode("utf-8"))
+      await writer.drain()
+
+    except (OSError, asyncio.CancelledError):
+      reply = None
+
+    finally:
+      self.callback = None
+      self.connection.finish(self, reply)
 
 
 class FileRenaming:
-  def __init__(self, source) -> None:
+  def __init__(self, filesystem: FileSystem, source) -> None:
+    self.filesystem = filesystem
     self.source = source
 
   def execute(self, target) -> None:
-    os.rename(self.source, target)
+    self.filesystem.rename(self.source, target)
 
 
 class DataConnection:
-  def __init__(self) -> None:
+  def __init__(self, pool: PortPool, metrics: Metrics, timeout: Optional[float] = None) -> None:
     self.type = "ascii"
+    self.mode = "S"
+    self.level = 6
+    self.pool = pool
+    self.metrics = metrics
+    self.timeout = timeout
+    self.throttle: Throttle = None
     self.handler: DataHandler = None
-    self.executor: Thread = None
 
   def get_read_type(self) -> str:
     if self.type == "utf-8":
@@ -101,6 +203,10 @@ class DataConnection:
     self.handler = handler
     self.handler.start()
 
+  def open(self, data_socket: socket.socket) -> None:
+    self.close()
+    self.set_handler(DataHandler(data_socket, self))
+
   def set_type(self, type) -> None:
     if type == "I":
       self.type = "utf-8"
@@ -114,84 +220,255 @@ class DataConnection:
       self.handler.join()
       self.handler = None
 
-    self.executor = None
+  def transfer(self, callback: Callable[[DataStream], Reply], client_socket: socket.socket) -> Reply:
+    self.metrics.add("ftp_transfers_active", 1)
+    start_time = time.perf_counter()
+
+    try:
+      stream = DataStream(client_socket, self.throttle, self.metrics)
+      if self.mode == "Z":
+        stream = DeflateStream(stream, self.level, CHUNK_SIZE)
+      elif self.mode == "B":
+        stream = BlockStream(stream)
+
+      reply = callback(stream)
+
+      try:
+        stream.flush()
+      except OSError as e:
+        reply = Reply.handle_error(e)
+
+      return reply
+
+    finally:
+      self.metrics.add("ftp_transfers_active", -1)
+      self.metrics.observe("ftp_transfer_duration_seconds", time.perf_counter() - start_time)
+
+  def keeps_alive(self, reply: Reply) -> bool:
+    return self.mode == "B" and reply.code == 226
+
+  def discard(self) -> None:
+    if self.mode != "B":
+      self.close()
 
   def check_connection(self) -> Optional[Reply]:
-    if not self.handler:
+    if not self.handler or self.handler.command_socket or not self.handler.is_running:
       return Reply(425, "Use PASV first.")
 
     return None
   
   def run(self, command_socket: socket.socket) -> None:
-    if self.handler and self.handler.callback and not self.executor:
-      self.executor = Thread(target=DataHandler.handle, args=(command_socket, self.handler, self.close))
-      self.executor.start()
+    if self.handler and self.handler.callback:
+      self.handler.start_transfer(command_socket)
 
+  def wait(self) -> None:
+    if self.handler:
+      self.handler.wait()
 
-class CommandHandler(Thread):
-  def __init__(self, host: str, socket: socket.socket, root: str, user: str, passwd: str) -> None:
-    Thread.__init__(self)
+  def is_transferring(self) -> bool:
+    return bool(self.handler and self.handler.command_socket and self.handler.is_alive())
 
-    self.host = host
-    self.root = root
-    self.user = user
-    self.passwd = passwd
+
+class AsyncDataConnection(DataConnection):
+  def __init__(self, pool: PortPool, metrics: Metrics, executor: Executor, timeout: Optional[float] = None) -> None:
+    DataConnection.__init__(self, pool, metrics, timeout)
+
+    self.handler: AsyncDataHandler = None
+    self.task: asyncio.Task = None
+    self.executor = executor
+
+  def set_handler(self, handler: AsyncDataHandler) -> None:
+    self.handler = handler
+
+  def open(self, data_socket: socket.socket) -> None:
+    self.close()
+    self.set_handler(AsyncDataHandler(data_socket, self))
+
+  def close(self) -> None:
+    if self.handler:
+      self.handler.close()
+      self.handler = None
+
+    self.task = None
+
+  def finish(self, handler: AsyncDataHandler, reply: Optional[Reply]) -> None:
+    if handler is not self.handler:
+      return
+
+    if reply and self.keeps_alive(reply):
+      self.task = None
+    else:
+      self.close()
+
+  def check_connection(self) -> Optional[Reply]:
+    if not self.handler or self.task:
+      return Reply(425, "Use PASV first.")
+
+    return None
+
+  def cancel(self) -> None:
+    if self.task:
+      self.task.cancel()
+
+    self.close()
+
+  async def wait(self) -> None:
+    if self.task:
+      await asyncio.wait([self.task])
+
+  def is_transferring(self) -> bool:
+    return bool(self.task and not self.task.done())
+
+  def run(self, writer: asyncio.StreamWriter) -> None:
+    if self.handler and self.handler.callback and not self.task:
+      self.task = asyncio.get_running_loop().create_task(
+        self.handler.handle(writer)
+      )
+
+
+class Command:
+  def __init__(self, handler: str, auth: bool = True, data: bool = False, arguments: str = "first", blocking: bool = False) -> None:
+    self.handler = handler
+    self.auth = auth
+    self.data = data
+    self.arguments = arguments
+    self.blocking = blocking
+
+  def call(self, session: "Session", arguments: List[str]) -> Reply:
+    handler = getattr(session, self.handler)
+
+    if self.arguments == "none":
+      return handler()
+
+    if self.arguments == "all":
+      return handler(arguments or [""])
+
+    return handler(arguments[0] if arguments else "")
+
+
+COMMANDS = {
+  "CD": Command("cwd"),
+  "CWD": Command("cwd"),
+  "DELE": Command("dele"),
+  "HASH": Command("hash", arguments="all", blocking=True),
+  "HELP": Command("help", arguments="none"),
+  "LIST": Command("ls", data=True),
+  "LS": Command("ls", data=True),
+  "MKD": Command("mkd"),
+  "MLSD": Command("mlsd", data=True),
+  "MDTM": Command("mdtm"),
+  "MLST": Command("mlst"),
+  "MODE": Command("mode"),
+  "OPTS": Command("opts", arguments="all"),
+  "PASS": Command("validate_password", auth=False, blocking=True),
+  "PASV": Command("pasv", arguments="none"),
+  "PWD": Command("pwd", arguments="none"),
+  "QUIT": Command("quit", auth=False, arguments="none"),
+  "RANG": Command("rang", arguments="all"),
+  "REST": Command("rest"),
+  "RETR": Command("retr", data=True, arguments="all"),
+  "RMD": Command("rmd"),
+  "RNFR": Command("rnfr"),
+  "RNTO": Command("rnto"),
+  "SIZE": Command("size"),
+  "STAT": Command("stat", blocking=True),
+  "STOR": Command("stor", data=True, arguments="all"),
+  "TYPE": Command("type"),
+  "USER": Command("validate_user", auth=False),
+  "XCRC": Command("xcrc", arguments="all", blocking=True),
+  "XMD5": Command("xmd5", arguments="all", blocking=True),
+}
+
+
+class Session:
+  def __init__(self, server: "FTPServer", data_connection: DataConnection) -> None:
+    self.host = server.host
+    self.root = server.root
+    self.users: UserStore = server.users
+    self.login: str = None
+    self.account: Optional[User] = None
     self.workdir = "/"
 
-    self.socket = socket
+    self.buffer_size = server.buffer_size
+    self.compressed_extensions = server.compressed_extensions
+    self.buffer: bytearray = None
+    self.durability: Durability = server.durability
+
+    self.offset = 0
+    self.range: Optional[Tuple[int, int]] = None
+
+    self.digests: DigestCache = server.digests
+    self.hash_algorithm = "SHA-256"
+
+    self.idle_timeout = server.idle_timeout
+    self.last_activity = time.monotonic()
+
+    self.filesystem: FileSystem = server.filesystem
+    self.listing: Listing = server.listing
+    self.files: FileCache = server.files
+    self.stat_cache: StatCache = server.stat_cache
+    self.stats: CommandStats = server.stats
+    self.metrics: Metrics = server.metrics
+    self.bandwidth: Bandwidth = server.bandwidth
 
     self.reply = Reply(220, "(myFTP 0.0.0)")
     self.is_running = True
 
-    self.data_connection: DataConnection = DataConnection()
+    self.data_connection = data_connection
+    self.data_connection.level = server.zlib_level
 
     self.file_renaming: FileRenaming = None
 
-  def __del__(self) -> None:
-    self.socket.close()
-  
   def check_auth(self) -> Optional[Reply]:
-    if len(self.user) or len(self.passwd):
+    if not self.account:
       return Reply(530, "Please login with USER and PASS.")
 
     return None
   
   def validate_user(self, user) -> Reply:
-    if self.user != user:
+    if self.account or not self.users.get(user):
       return Reply(530, "Permission denied.")
     
-    self.user = ""
+    self.login = user
     return Reply(331, "Please specify the password.")
   
   def validate_password(self, passwd) -> Reply:
-    if len(self.user):
+    if not self.login or self.account:
       return Reply(503, "Login with USER first.")
 
-    if self.passwd != passwd:
+    account, is_cached = self.users.verify(self.login, passwd)
+    self.metrics.add("ftp_auth_cache_hits_total" if is_cached else "ftp_auth_cache_misses_total", 1)
+
+    if not account:
+      self.metrics.add("ftp_logins_failed_total", 1)
       return Reply(530, "Login incorrect.")
-    
-    self.passwd = ""
+
+    root = os.path.normpath(Path.merge(self.root, account.home))
+    if not Path.is_inside(self.root, root) or not self.filesystem.isdir(root):
+      return Reply(530, "Home directory not available.")
+
+    self.account = account
+    self.root = root
+    self.data_connection.throttle = self.bandwidth.throttle(self.login)
     return Reply(230, "Login successful.")
 
+  def resolve(self, path: str) -> str:
+    # Normalizing the virtual path against "/" clamps any ".." at the session root.
+    return "/" + posixpath.normpath(posixpath.join(self.workdir, path)).lstrip("/")
+
   def handle_directory(self, path: str) -> str:
-    directory = self.workdir
-    if len(path):
-      if path[0] != "/":
-        directory += "/" + path
-      
-      else:
-        directory = path
-    
-    return Path.merge(self.root, directory)
+    filepath = Path.merge(self.root, self.resolve(path))
+
+    # Links are resolved as well, so a symlink cannot lead out of the session root either.
+    if not Path.is_inside(self.filesystem.realpath(self.root), self.filesystem.realpath(filepath)):
+      raise PermissionError(f"Path outside of the root: {path}")
+
+    return filepath
 
   def cwd(self, directory: str) -> Reply:
     if directory:
-      if os.path.isdir(self.handle_directory(directory)):
-        if directory[0] != "/":
-          self.workdir += directory
-        
-        else:
-          self.workdir = directory
+      if self.filesystem.isdir(self.handle_directory(directory)):
+        self.workdir = self.resolve(directory)
 
         return Reply(250, "Directory successfully changed.")
 
@@ -205,46 +482,71 @@ class CommandHandler(Thread):
     else:
       return Reply(500, "Unrecognized TYPE command.")
 
-  def pasv(self) -> Reply:
-    port = None
-    start_time = time.perf_counter()
+  def mode(self, mode: str) -> Reply:
+    mode = mode.upper()
 
-    while True:
-      port = randint(59999, 65535)
+    if mode in ["S", "Z", "B"]:
+      self.data_connection.mode = mode
+      return Reply(200, f"Mode set to {mode}.")
 
-      if DataHandler.is_port_open(self.host, port):
-        break
+    return Reply(504, "Bad MODE command.")
 
-      if time.perf_counter() - start_time > 3.0:
-        break
+  def pasv(self) -> Reply:
+    pool = self.data_connection.pool
+    data_socket = pool.acquire()
 
-    if port:
-      data_socket = Socket(self.host, port)
+    if data_socket:
+      self.data_connection.open(data_socket)
 
-      if data_socket.connect():
-        self.data_connection.set_handler(DataHandler(data_socket.get()))
+      address = self.host.replace('.', ',')
+      port = data_socket.getsockname()[1]
+      if not pool.first <= port <= pool.last:
+        self.metrics.add("ftp_pasv_ephemeral_total", 1)
 
-        address = self.host.replace('.', ',')
-        port = [int(port / 256), (port % 256)]
+      port = [int(port / 256), (port % 256)]
 
-        return Reply(227, f"Entering Passive Mode ({address},{port[0]},{port[1]}).")
+      return Reply(227, f"Entering Passive Mode ({address},{port[0]},{port[1]}).")
 
+    self.metrics.add("ftp_pasv_failures_total", 1)
     return Reply(421, "Failed to enter Passive Mode.")
 
-  def ls(self, directory: str) -> Reply:
+  def lookup(self, path: str) -> Optional[os.stat_result]:
+    stats, is_cached = self.stat_cache.lookup(path)
+    self.metrics.add("ftp_stat_cache_hits_total" if is_cached else "ftp_stat_cache_misses_total", 1)
+
+    return stats
+
+  def invalidate(self, path: str) -> None:
+    directory = os.path.dirname(path)
+
+    self.files.invalidate(path)
+    self.stat_cache.invalidate(path)
+    self.stat_cache.invalidate(directory)
+    self.listing.invalidate(directory)
+
+  def ls(self, directory: str, kind: str = "list") -> Reply:
     directory = self.handle_directory(directory)
 
-    def callback(client_socket: socket.socket) -> Reply:
+    def callback(stream: DataStream) -> Reply:
       try:
-        items = ""
+        stats = self.lookup(directory)
+
+        if stats:
+          items = []
+          size = 0
+
+          for item in self.listing.lines(directory, kind, stats):
+            items.append(item)
+            size += len(item)
 
-        if os.path.exists(directory):
-          for item in os.popen(f"ls -n {directory}").readlines():
-            if len(item) and (item[0] == '-' or item[0] == 'd'):
-              items += item.replace('\n', "")
-              items += "\r\n"
+            if size >= CHUNK_SIZE:
+              stream.sendall(("\r\n".join(items) + "\r\n").encode(self.data_connection.type))
+              items = []
+              size = 0
+
+          if items:
+            stream.sendall(("\r\n".join(items) + "\r\n").encode(self.data_connection.type))
 
-        client_socket.sendall(items.encode(self.data_connection.type))
         return Reply(226, "Directory send OK.")
 
       except Exception as e:
@@ -254,6 +556,17 @@ class CommandHandler(Thread):
 
     return Reply(150, "Here comes the directory listing.")
 
+  def mlst(self, path: str) -> Reply:
+    filepath = self.handle_directory(path)
+    stats = self.lookup(filepath)
+
+    if stats:
+      name = path or self.workdir
+
+      return Reply.multiline(250, f"Listing {name}", [" " + Listing.format_facts(name, stats)], "End.")
+
+    return Reply(550, "Could not list file.")
+
   def retr(self, filenames: List[str]) -> Reply:
     if len(filenames):
       callback = None
@@ -262,30 +575,79 @@ class CommandHandler(Thread):
       filepath = self.handle_directory(filename)
       filesize = 0
 
-      if os.path.isfile(filepath):
-        filesize = os.path.getsize(filepath)
+      offset = self.offset
+      self.offset = 0
+
+      stats = self.lookup(filepath)
 
-        def callback(client_socket: socket.socket) -> Reply:
+      if stats and stat.S_ISREG(stats.st_mode):
+        filesize = stats.st_size
+
+        def callback(stream: DataStream) -> Reply:
           try:
-            content = ""
-            with open(filepath, self.data_connection.get_read_type()) as file:
-              content = file.read()
+            stream.set_compressible(not filepath.lower().endswith(self.compressed_extensions))
 
-            if self.data_connection.type == "ascii":
-              content = content.encode(self.data_connection.type)
+            content = None
+            if self.data_connection.type != "ascii":
+              content, is_cached = self.files.get(filepath)
+              self.metrics.add("ftp_file_cache_hits_total" if is_cached else "ftp_file_cache_misses_total", 1)
+
+            if content is not None:
+              stream.sendall(memoryview(content)[offset:])
+              return Reply(226, "Transfer complete.")
+
+            with self.filesystem.open(filepath, self.data_connection.get_read_type()) as file:
+              if self.data_connection.type == "ascii":
+                skipped = 0
+                while skipped < offset:
+                  content = file.read(min(CHUNK_SIZE, offset - skipped))
+                  if not content:
+                    break
+
+                  skipped += len(content)
+
+                while True:
+                  content = file.read(CHUNK_SIZE)
+                  if not content:
+                    break
+
+                  stream.sendall(content.encode(self.data_connection.type))
+
+              else:
+                stream.sendfile(file, offset)
 
-            client_socket.sendall(content)
             return Reply(226, "Transfer complete.")
 
           except Exception as e:
             return Reply.handle_error(e)
 
+      elif Archive.target(filepath, self.root, self.filesystem):
+        if offset:
+          self.data_connection.discard()
+          return Reply(554, "Restart is not supported for archives.")
+
+        directory, format = Archive.target(filepath, self.root, self.filesystem)
+        archive = Archive(directory, format, self.data_connection.level, self.compressed_extensions, self.filesystem)
+
+        def callback(stream: DataStream) -> Reply:
+          try:
+            stream.set_compressible(format != ".zip")
+            archive.write(stream, CHUNK_SIZE)
+
+            return Reply(226, "Transfer complete.")
+
+          except Exception as e:
+            return Reply.handle_error(e)
+
+        self.data_connection.handler.set_callback(callback)
+        return Reply(150, f"Opening Binary mode data connection for {filename} (streamed archive).")
+
       if callback:
         self.data_connection.handler.set_callback(callback)
         return Reply(150, f"Opening {self.data_connection.get_mode_type()} mode data connection for {filename} ({filesize} bytes).")
 
       else:
-        self.data_connection.handler = None
+        self.data_connection.discard()
 
     return Reply(550, "Failed to open file.")
 
@@ -296,39 +658,170 @@ class CommandHandler(Thread):
       if len(filenames) == 2:
         filename = filenames[1]
 
-      def callback(client_socket: socket.socket) -> Reply:
+      offset = self.offset
+      self.offset = 0
+
+      filepath = self.handle_directory(filename)
+      directory, name = os.path.split(filepath)
+
+      def callback(stream: DataStream) -> Reply:
+
+        # Resumed uploads extend the existing file in place; everything else becomes visible only once complete.
+        temporary = None
+        if not (offset and self.filesystem.isfile(filepath)):
+          temporary = os.path.join(directory, f".{name}.{os.urandom(6).hex()}.part")
+
         try:
-          filepath = self.handle_directory(filename)
-          print(filepath)
-          
-          content = b""
-
-          while True:
-            buffer = client_socket.recv(1024)
-
-            if buffer:
-              content += buffer
-            else:
-              break
-
-          with open(filepath, self.data_connection.get_write_type()) as file:
-            if (self.data_connection.type == "ascii"):
-              content = content.decode("utf-8")
-            file.write(content)
+          if not self.buffer:
+            self.buffer = bytearray(self.buffer_size)
+
+          buffer = memoryview(self.buffer)
+          decoder = codecs.getincrementaldecoder("utf-8")()
+
+          with self.filesystem.open(temporary or filepath, "wb" if temporary else "r+b") as file:
+            file.seek(offset)
+
+            while True:
+              size = stream.recv_into(buffer)
+              if not size:
+                break
+
+              if self.data_connection.type == "ascii":
+                file.write(decoder.decode(buffer[:size]).encode("utf-8"))
+              else:
+                file.write(buffer[:size])
+
+            if self.data_connection.type == "ascii":
+              file.write(decoder.decode(b"", final=True).encode("utf-8"))
+
+            file.truncate()
+            self.durability.sync(self.filesystem, file)
+
+          if temporary:
+            self.filesystem.replace(temporary, filepath)
+            temporary = None
+
+            self.durability.sync_directory(self.filesystem, directory)
+
+          self.invalidate(filepath)
           return Reply(226, "Transfer complete.")
 
         except Exception as e:
           return Reply.handle_error(e)
 
+        finally:
+          if temporary:
+            try:
+              self.filesystem.remove(temporary)
+            except OSError:
+              pass
+
       self.data_connection.handler.set_callback(callback)
 
     return Reply(150, "Ok to send data.")
 
+  def rest(self, offset: str) -> Reply:
+    if not offset.isdigit():
+      return Reply(501, "REST requires a value greater than or equal to 0.")
+
+    self.offset = int(offset)
+    return Reply(350, f"Restart position accepted ({self.offset}).")
+
+  def size(self, filename: str) -> Reply:
+    if filename:
+      stats = self.lookup(self.handle_directory(filename))
+
+      if stats and stat.S_ISREG(stats.st_mode):
+        return Reply(213, str(stats.st_size))
+
+    return Reply(550, "Could not get file size.")
+
+  def mdtm(self, filename: str) -> Reply:
+    if filename:
+      stats = self.lookup(self.handle_directory(filename))
+
+      if stats and stat.S_ISREG(stats.st_mode):
+        return Reply(213, time.strftime("%Y%m%d%H%M%S", time.gmtime(stats.st_mtime)))
+
+    return Reply(550, "Could not get file modification time.")
+
+  def opts(self, arguments: List[str]) -> Reply:
+    if arguments[0].upper() != "HASH":
+      return Reply(501, "Option not understood.")
+
+    if len(arguments) == 1:
+      return Reply(200, self.hash_algorithm)
+
+    algorithm = arguments[1].upper()
+    if algorithm not in DigestCache.ALGORITHMS:
+      return Reply(504, "Unknown algorithm, current selection not changed.")
+
+    self.hash_algorithm = algorithm
+    return Reply(200, algorithm)
+
+  def rang(self, arguments: List[str]) -> Reply:
+    if len(arguments) != 2 or not all(argument.isdigit() for argument in arguments):
+      return Reply(501, "RANG requires a start and an end byte.")
+
+    start, end = int(arguments[0]), int(arguments[1])
+
+    if (start, end) == (1, 0):
+      self.range = None
+      return Reply(350, "Restarting at 0. End byte range at EOF.")
+
+    if start > end:
+      return Reply(501, "RANG start is greater than end.")
+
+    self.range = (start, end)
+    return Reply(350, f"Restarting at {start}. End byte range at {end}.")
+
+  def checksum(self, path: str, algorithm: str, start: int = 0, end: Optional[int] = None) -> Optional[str]:
+    filepath = self.handle_directory(path)
+
+    if not path or not self.filesystem.isfile(filepath):
+      return None
+
+    digest, is_cached = self.digests.digest(filepath, algorithm, start, end)
+    self.metrics.add("ftp_digest_cache_hits_total" if is_cached else "ftp_digest_cache_misses_total", 1)
+
+    return digest
+
+  def hash(self, arguments: List[str]) -> Reply:
+    path = " ".join(arguments)
+
+    start, end = 0, None
+    if self.range:
+      start, end = self.range[0], self.range[1] + 1
+      self.range = None
+
+    digest = self.checksum(path, self.hash_algorithm, start, end)
+    if digest is None:
+      return Reply(550, "Could not get file hash.")
+
+    size = self.filesystem.stat(self.handle_directory(path)).st_size
+    last = min(end, size) - 1 if end is not None else size - 1
+
+    return Reply(213, f"{self.hash_algorithm} {start}-{max(last, start)} {digest} {path}")
+
+  def xmd5(self, arguments: List[str]) -> Reply:
+    digest = self.checksum(" ".join(arguments), "MD5")
+    if digest is None:
+      return Reply(550, "Could not get file hash.")
+
+    return Reply(250, digest.upper())
+
+  def xcrc(self, arguments: List[str]) -> Reply:
+    digest = self.checksum(" ".join(arguments), "CRC32")
+    if digest is None:
+      return Reply(550, "Could not get file hash.")
+
+    return Reply(250, digest.upper())
+
   def rnfr(self, source) -> Reply:
     if source:
       source = self.handle_directory(source)
-      if os.path.exists(source):
-        self.file_renaming = FileRenaming(source)
+      if self.filesystem.exists(source):
+        self.file_renaming = FileRenaming(self.filesystem, source)
 
         return Reply(350, "Ready for RNTO.")
 
@@ -340,7 +833,11 @@ class CommandHandler(Thread):
 
     if target:
       try:
-        self.file_renaming.execute(self.handle_directory(target))
+        target = self.handle_directory(target)
+        self.file_renaming.execute(target)
+
+        self.invalidate(self.file_renaming.source)
+        self.invalidate(target)
         return Reply(250, "Rename successful.")
 
       except Exception as e:
@@ -351,10 +848,11 @@ class CommandHandler(Thread):
   def mkd(self, directory) -> Reply:
     if directory:
       try:
-        os.mkdir(self.handle_directory(directory))
-        if self.workdir != "/":
-          directory = "/" + directory
-        return Reply(250, f"\"{self.workdir + directory}\" created.")
+        path = self.handle_directory(directory)
+        self.filesystem.mkdir(path)
+        self.invalidate(path)
+
+        return Reply(250, f"\"{self.resolve(directory)}\" created.")
 
       except Exception as e:
         return Reply.handle_error(e)
@@ -365,18 +863,21 @@ class CommandHandler(Thread):
     return Reply(257, f"\"{self.workdir}\" is the current directory.")
 
   def help(self) -> Reply:
-    self.socket.sendall(("214-The following commands are recognized.\r\n" +
-      "CD  CWD  DELE HELP LIST LS   MKD  PASS PASV\r\n" +
-      "PWD QUIT RETR RMD  RNFR RNTO STOR TYPE USER\r\n").encode("utf-8"))
-    return Reply(214, "Help OK.")
+    verbs = sorted(COMMANDS)
+    lines = [" ".join(f"{verb:<4}" for verb in verbs[index:index + 11]).rstrip() for index in range(0, len(verbs), 11)]
+
+    return Reply.multiline(214, "The following commands are recognized.", lines, "Help OK.")
 
   def dele(self, filename) -> Reply:
     if filename:
       filepath = self.handle_directory(filename)
 
       try:
-        if os.path.isfile(filepath):
-          os.remove(filepath)
+        stats = self.lookup(filepath)
+
+        if stats and stat.S_ISREG(stats.st_mode):
+          self.filesystem.remove(filepath)
+          self.invalidate(filepath)
 
           return Reply(250, "Delete operation successful.")
       
@@ -390,8 +891,10 @@ class CommandHandler(Thread):
       directory = self.handle_directory(directory)
 
       try:
-        if os.path.isdir(directory):
-          os.rmdir(directory)
+        if self.filesystem.isdir(directory):
+          self.filesystem.rmdir(directory)
+          self.listing.invalidate(directory)
+          self.invalidate(directory)
 
           return Reply(250, "Remove directory operation successful.")
       
@@ -400,98 +903,233 @@ class CommandHandler(Thread):
 
     return Reply(550, "Remove directory operation failed.")
 
+  def quit(self) -> Reply:
+    self.is_running = False
+    return Reply(221, "Goodbye.")
+
+  def mlsd(self, directory: str) -> Reply:
+    return self.ls(directory, "mlsd")
+
+  def stat(self, path: str) -> Reply:
+    if path:
+      filepath = self.handle_directory(path)
+
+      if self.filesystem.exists(filepath):
+        return Reply.multiline(213, "Status follows:", list(self.listing.lines(filepath)), "End of status.")
+
+      return Reply(550, "Could not get status.")
+
+    return Reply.multiline(211, "FTP server status:", [
+      f"Connected to {self.host}",
+      f"Logged in as {'nobody' if self.check_auth() else self.login}",
+      f"TYPE: {self.data_connection.get_mode_type()}",
+      "Server counters:"
+    ] + self.metrics.dump() + ["Command latency:"] + self.stats.dump(), "End of status.")
+
+  def is_idle(self, timeout: Optional[float] = None) -> bool:
+    timeout = timeout or self.idle_timeout
+
+    return bool(timeout) and not self.data_connection.is_transferring() \
+      and time.monotonic() - self.last_activity > timeout
+
+  @staticmethod
+  def redact(line: str) -> str:
+    if line[:4].upper() == "PASS":
+      return "PASS ****"
+
+    return line
+
+  def is_blocking(self, line: str) -> bool:
+    words = line.split()
+    command = COMMANDS.get(words[0].upper()) if words else None
+
+    return bool(command and command.blocking)
+
+  def execute(self, line: str) -> Reply:
+    self.last_activity = time.monotonic()
+
+    words = line.split()
+    verb = words[0].upper()
+
+    command = COMMANDS.get(verb)
+    if not command:
+      return Reply()
+
+    start_time = time.perf_counter()
+
+    try:
+      if command.auth and self.check_auth():
+        reply = self.check_auth()
+
+      elif command.data and self.data_connection.check_connection():
+        reply = self.data_connection.check_connection()
+
+      else:
+        reply = command.call(self, words[1:])
+
+    except PermissionError:
+      reply = Reply(550, "Permission denied.")
+
+    except Exception as e:
+      reply = Reply.handle_error(e)
+
+    self.stats.record(verb, time.perf_counter() - start_time)
+
+    if self.reply:
+      reply = self.reply + reply
+      self.reply = None
+
+    return reply
+
+
+class CommandHandler(Session, Thread):
+  def __init__(self, server: "FTPServer", socket: socket.socket, address: Tuple[str, int]) -> None:
+    Session.__init__(self, server, DataConnection(server.pool, server.metrics, server.data_timeout))
+    Thread.__init__(self)
+
+    self.server = server
+    self.socket = socket
+    self.socket.settimeout(server.idle_timeout)
+    self.address, port = address[:2]
+    self.peer = f"{self.address}:{port}"
+
+  def __del__(self) -> None:
+    self.socket.close()
+
+  def close(self) -> None:
+    try:
+      self.socket.shutdown(socket.SHUT_RDWR)
+    except OSError:
+      pass
+
   def run(self):
-    while self.is_running:
-      command = self.socket.recv(4096).decode("utf-8")
+    lines = LineReader()
+
+    try:
+      while self.is_running:
+        try:
+          data = self.socket.recv(4096)
+
+        except socket.timeout:
+          if self.data_connection.is_transferring():
+            continue
+
+          self.send_timeout()
+          break
+
+        except OSError:
+          break
 
-      print(self.socket.getpeername(), end=": ")
-      print(command)
+        if not data:
+          break
 
-      if command:
         try:
-          commands = command.split()
-          command = commands[0]
+          commands = lines.feed(data)
 
-          argument = [""]
-          if len(commands) > 1:
-            argument = commands[1:]
+        except ValueError:
+          self.send(Reply(500, "Command line too long."))
+          continue
 
-          reply = Reply()
+        for command in commands:
+          if not self.is_running:
+            break
 
-          if command in ["CD", "CWD", "DELE", "HELP", "LIST", \
-            "LS", "MKD", "PASS", "PASV", "PWD", "QUIT", "RETR", \
-            "RMD", "RNFR", "RNTO", "STOR", "TYPE", "USER"]:
+          self.data_connection.wait()
 
-            if command == "USER":
-              reply = self.validate_user(argument[0])
+          logger.sampled("info", "command", peer=self.peer, command=Session.redact(command))
 
-            elif command == "QUIT":
-              reply = Reply(221, "Goodbye.")
-              self.is_running = False
+          try:
+            reply = self.execute(command)
 
-            elif command == "PASS":
-              reply = self.validate_password(argument[0])
+            self.socket.sendall(reply.get().encode("utf-8"))
 
-            elif not self.check_auth():
-              if command == "CWD" or command == "CD":
-                reply = self.cwd(argument[0])
+            self.data_connection.run(self.socket)
 
-              elif command == "TYPE":
-                reply = self.type(argument[0])
+          except Exception as e:
+            self.send(Reply.handle_error(e))
 
-              elif command == "PASV":
-                reply = self.pasv()
+    finally:
+      self.data_connection.close()
+      self.socket.close()
 
-              elif command == "RNFR":
-                reply = self.rnfr(argument[0])
+      self.server.release(self)
 
-              elif command == "RNTO":
-                reply = self.rnto(argument[0])
+  def send_timeout(self) -> None:
+    self.send(Reply(421, "Timeout."))
 
-              elif command == "MKD":
-                reply = self.mkd(argument[0])
+  def send(self, reply: Reply) -> None:
+    try:
+      self.socket.sendall(reply.get().encode("utf-8"))
+    except OSError:
+      pass
 
-              elif command == "PWD":
-                reply = self.pwd()
+  def shutdown(self) -> None:
+    self.send(Reply(421, "Service not available, closing control connection."))
+    self.close()
 
-              elif command == "HELP":
-                reply = self.help()
 
-              elif command == "DELE":
-                reply = self.dele(argument[0])
+class AsyncCommandHandler(Session):
+  def __init__(self, server: "FTPServer", reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+    Session.__init__(self, server, AsyncDataConnection(server.pool, server.metrics, server.executor, server.data_timeout))
 
-              elif command == "RMD":
-                reply = self.rmd(argument[0])
+    self.reader = reader
+    self.writer = writer
+    self.executor = server.control_executor
+    address, port = writer.get_extra_info("peername")[:2]
+    self.peer = f"{address}:{port}"
 
-              elif command in ["LIST", "LS", "RETR", "STOR"]:
-                if not self.data_connection.check_connection():
-                  if command == "LIST" or command == "LS":
-                    reply = self.ls(argument[0])
+  def shutdown(self) -> None:
+    self.writer.write(Reply(421, "Service not available, closing control connection.").get().encode("utf-8"))
+    self.writer.close()
 
-                  elif command == "RETR":
-                    reply = self.retr(argument)
+  async def run(self) -> None:
+    lines = LineReader()
 
-                  elif command == "STOR":
-                    reply = self.stor(argument)
+    try:
+      while self.is_running:
+        try:
+          data = await asyncio.wait_for(self.reader.read(4096), self.idle_timeout)
 
-                else:
-                  reply = self.data_connection.check_connection()
+        except asyncio.TimeoutError:
+          if self.data_connection.is_transferring():
+            continue
 
-            else:
-              reply = self.check_auth()
+          self.writer.write(Reply(421, "Timeout.").get().encode("utf-8"))
+          await self.writer.drain()
+          break
 
-            if self.reply:
-              reply = self.reply + reply
-              self.reply = None
+        if not data:
+          break
 
-          self.data_connection.run(self.socket)
+        try:
+          commands = lines.feed(data)
 
-          self.socket.sendall(reply.get().encode("utf-8"))
+        except ValueError:
+          self.writer.write(Reply(500, "Command line too long.").get().encode("utf-8"))
+          await self.writer.drain()
+          continue
 
-        except Exception as e:
-          self.socket.sendall(Reply.handle_error(e).get().encode("utf-8"))
+        for command in commands:
+          if not self.is_running:
+            break
 
-      else:
-        break
+          await self.data_connection.wait()
+
+          logger.sampled("info", "command", peer=self.peer, command=Session.redact(command))
+
+          if self.is_blocking(command):
+            reply = await asyncio.get_running_loop().run_in_executor(self.executor, self.execute, command)
+          else:
+            reply = self.execute(command)
+
+          self.writer.write(reply.get().encode("utf-8"))
+          await self.writer.drain()
+
+          self.data_connection.run(self.writer)
+
+    except (ConnectionError, asyncio.CancelledError):
+      pass
 
-    self.data_connection.close()
+    finally:
+      self.data_connection.cancel()
+      self.writer.close()
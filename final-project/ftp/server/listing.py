@@ -0,0 +1,88 @@
+from collections import OrderedDict
+from statcache import StatCache
+from threading import Lock
+from typing import Iterator, List, Optional, Tuple
+from vfs import FileSystem, LocalFileSystem, is_settled
+import os
+import stat
+import time
+
+
+class Listing:
+  def __init__(self, capacity: int = 256, stat_cache: Optional[StatCache] = None, \
+    filesystem: Optional[FileSystem] = None) -> None:
+    self.capacity = capacity
+    self.stat_cache = stat_cache
+    self.filesystem = filesystem or LocalFileSystem()
+
+    self.entries: "OrderedDict[Tuple[str, str], Tuple[int, List[str]]]" = OrderedDict()
+    self.lock = Lock()
+
+  @staticmethod
+  def format_list(name: str, stats: os.stat_result) -> str:
+    if abs(time.time() - stats.st_mtime) < 182 * 24 * 60 * 60:
+      modified = time.strftime("%b %d %H:%M", time.localtime(stats.st_mtime))
+    else:
+      modified = time.strftime("%b %d  %Y", time.localtime(stats.st_mtime))
+
+    return f"{stat.filemode(stats.st_mode)} {stats.st_nlink} {stats.st_uid} {stats.st_gid} " \
+      f"{stats.st_size:>12} {modified} {name}"
+
+  @staticmethod
+  def format_facts(name: str, stats: os.stat_result) -> str:
+    type = "dir" if stat.S_ISDIR(stats.st_mode) else "file"
+    modified = time.strftime("%Y%m%d%H%M%S", time.gmtime(stats.st_mtime))
+
+    return f"type={type};size={stats.st_size};modify={modified};" \
+      f"unix.mode={stat.S_IMODE(stats.st_mode):04o};unix.uid={stats.st_uid};unix.gid={stats.st_gid}; {name}"
+
+  def invalidate(self, directory: str) -> None:
+    directory = os.path.normpath(directory)
+
+    with self.lock:
+      for key in [key for key in self.entries if key[0] == directory]:
+        del self.entries[key]
+
+  def lines(self, path: str, kind: str = "list", stats: Optional[os.stat_result] = None) -> Iterator[str]:
+    format = Listing.format_facts if kind == "mlsd" else Listing.format_list
+
+    stats = stats or self.filesystem.stat(path)
+    if not stat.S_ISDIR(stats.st_mode):
+      yield format(os.path.basename(path), stats)
+      return
+
+    key = (os.path.normpath(path), kind)
+    with self.lock:
+      cached = self.entries.get(key)
+      if cached and cached[0] == stats.st_mtime_ns:
+        self.entries.move_to_end(key)
+        lines = cached[1]
+      else:
+        lines = None
+
+    if lines is not None:
+      yield from lines
+      return
+
+    lines = []
+    for entry in self.filesystem.scandir(path):
+      # Hidden entries stay unlisted as with "ls -n"; that includes the temp files of uploads in flight.
+      if entry.name.startswith("."):
+        continue
+
+      if self.stat_cache and not entry.is_symlink():
+        self.stat_cache.put(entry.path, entry.stats)
+
+      if entry.is_file() or entry.is_dir():
+        line = format(entry.name, entry.stats)
+        lines.append(line)
+
+        yield line
+
+    if is_settled(stats):
+      with self.lock:
+        self.entries[key] = (stats.st_mtime_ns, lines)
+        self.entries.move_to_end(key)
+
+        while len(self.entries) > self.capacity:
+          self.entries.popitem(last=False)
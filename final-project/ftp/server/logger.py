@@ -0,0 +1,117 @@
+from queue import Empty, Full, Queue
+from threading import Lock, Thread
+from typing import Optional, TextIO
+import json
+import os
+import random
+import sys
+import time
+
+
+class Logger:
+  LEVELS = {"debug": 10, "info": 20, "warning": 30, "error": 40}
+
+  def __init__(self, level: str = "info", format: str = "text", filepath: str = "", sample: float = 1.0, \
+    capacity: int = 10000) -> None:
+    self.configure(level, format, filepath, sample, capacity)
+
+    self.dropped = 0
+    self.pid: Optional[int] = None
+    self.queue: Queue = None
+    self.lock = Lock()
+
+  def configure(self, level: str = "info", format: str = "text", filepath: str = "", sample: float = 1.0, \
+    capacity: int = 10000) -> None:
+    self.level = Logger.LEVELS.get(level.lower(), Logger.LEVELS["info"])
+    self.format = format
+    self.filepath = filepath
+    self.sample = sample
+    self.capacity = capacity
+
+  def start(self) -> None:
+    with self.lock:
+      if self.pid == os.getpid():
+        return
+
+      self.queue = Queue(self.capacity)
+      self.pid = os.getpid()
+
+      Thread(target=self.write, args=(self.queue,), daemon=True).start()
+
+  def log(self, level: str, event: str, **fields) -> None:
+    if Logger.LEVELS[level] < self.level:
+      return
+
+    if self.pid != os.getpid():
+      self.start()
+
+    try:
+      self.queue.put_nowait((time.time(), level, event, fields))
+    except Full:
+      self.dropped += 1
+
+  def sampled(self, level: str, event: str, **fields) -> None:
+    if self.sample < 1.0 and random.random() >= self.sample:
+      return
+
+    self.log(level, event, **fields)
+
+  def debug(self, event: str, **fields) -> None:
+    self.log("debug", event, **fields)
+
+  def info(self, event: str, **fields) -> None:
+    self.log("info", event, **fields)
+
+  def warning(self, event: str, **fields) -> None:
+    self.log("warning", event, **fields)
+
+  def error(self, event: str, **fields) -> None:
+    self.log("error", event, **fields)
+
+  def render(self, record: tuple) -> str:
+    timestamp, level, event, fields = record
+    moment = time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(timestamp)) + f".{int(timestamp * 1000) % 1000:03d}"
+
+    if self.format == "json":
+      return json.dumps({"time": moment, "level": level, "event": event, **fields}, default=str)
+
+    return " ".join([moment, level.upper(), event] + [f"{key}={value!r}" for key, value in fields.items()])
+
+  def open(self) -> TextIO:
+    if self.filepath:
+      return open(self.filepath, "a")
+
+    return sys.stdout
+
+  def write(self, queue: Queue) -> None:
+    output = self.open()
+
+    while True:
+      records = [queue.get()]
+
+      try:
+        while len(records) < 256:
+          records.append(queue.get_nowait())
+      except Empty:
+        pass
+
+      lines = [self.render(record) for record in records]
+      if self.dropped:
+        lines.append(self.render((time.time(), "warning", "log_dropped", {"records": self.dropped})))
+        self.dropped = 0
+
+      try:
+        output.write("".join(f"{line}\n" for line in lines))
+        output.flush()
+      except (OSError, ValueError):
+        pass
+
+      for _ in records:
+        queue.task_done()
+
+  def flush(self) -> None:
+    if self.pid == os.getpid():
+      self.queue.join()
+
+
+logger = Logger()
@@ -1,15 +1,56 @@
 from utils import Config
-from ftp import FTPServer
+from ftp import AsyncFTPServer, FTPServer
+from logger import logger
+from prefork import Supervisor
+from typing import Callable, Optional
+from users import PasswordHash
+import argparse
+import getpass
+import os
+
+
+def create_server(config: dict, loader: Optional[Callable[[], dict]] = None) -> FTPServer:
+  if config.get('mode', 'thread') == 'async':
+    return AsyncFTPServer(config, loader)
+
+  return FTPServer(config, loader)
 
 
 if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description='Run the FTP server')
+  parser.add_argument('--config', help='specify the configuration file', type=str, default='./ftp.conf')
+  parser.add_argument('--workers', help='specify the number of worker processes', type=int, default=None)
+  parser.add_argument('--hash-password', help='read a password and print its hash for the users file', nargs='?', \
+    const='scrypt', choices=['scrypt', 'pbkdf2'])
+
+  args = parser.parse_args()
+
+  if args.hash_password:
+    print(PasswordHash.create(getpass.getpass(), args.hash_password))
+    raise SystemExit(0)
+
   try:
-    config = Config('./ftp.conf')
+    source = Config(args.config)
+    config = source.get()
+
+    logger.configure(
+      config.get('log_level', 'info'),
+      config.get('log_format', 'text'),
+      config.get('log_file', ''),
+      float(config.get('log_sample', 1.0)),
+      int(config.get('log_queue_size', 10000))
+    )
+
+    workers = args.workers or int(config.get('workers', 1))
+
+    if workers > 1 and hasattr(os, 'fork'):
+      Supervisor(config, workers, create_server, source.get).run()
 
-    server = FTPServer(config.get())
+    else:
+      server = create_server(config, source.get)
 
-    if server.connect():
-      server.run()
+      if server.connect():
+        server.run()
   
   except Exception as e:
     print(e)
@@ -0,0 +1,186 @@
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Lock, Thread
+from typing import Dict, List
+import os
+import time
+
+
+class Histogram:
+  BUCKETS = [
+    0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01,
+    0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0
+  ]
+
+  def __init__(self) -> None:
+    self.counts = [0] * (len(Histogram.BUCKETS) + 1)
+    self.count = 0
+    self.sum = 0.0
+    self.max = 0.0
+
+  def observe(self, value: float) -> None:
+    self.counts[bisect_left(Histogram.BUCKETS, value)] += 1
+    self.count += 1
+    self.sum += value
+    self.max = max(self.max, value)
+
+  def quantile(self, q: float) -> float:
+    rank = q * self.count
+    total = 0
+
+    for index, count in enumerate(self.counts):
+      total += count
+      if total >= rank and count:
+        if index < len(Histogram.BUCKETS):
+          return Histogram.BUCKETS[index]
+
+        return self.max
+
+    return 0.0
+
+
+class CommandStats:
+  def __init__(self) -> None:
+    self.histograms: Dict[str, Histogram] = {}
+    self.lock = Lock()
+
+  def record(self, verb: str, elapsed: float) -> None:
+    with self.lock:
+      histogram = self.histograms.get(verb)
+      if not histogram:
+        histogram = self.histograms[verb] = Histogram()
+
+      histogram.observe(elapsed)
+
+  def dump(self) -> List[str]:
+    lines = []
+
+    with self.lock:
+      for verb in sorted(self.histograms):
+        histogram = self.histograms[verb]
+
+        lines.append(
+          f"{verb:<4} calls={histogram.count} avg={histogram.sum / histogram.count * 1000:.3f}ms "
+          f"p50<={histogram.quantile(0.5) * 1000:g}ms p99<={histogram.quantile(0.99) * 1000:g}ms "
+          f"max={histogram.max * 1000:.3f}ms"
+        )
+
+    return lines
+
+
+class Metrics:
+  COUNTERS = [
+    "ftp_sessions_total", "ftp_sessions_rejected_total", "ftp_bytes_sent_total", "ftp_bytes_received_total",
+    "ftp_pasv_ephemeral_total", "ftp_pasv_failures_total", "ftp_digest_cache_hits_total", "ftp_digest_cache_misses_total",
+    "ftp_file_cache_hits_total", "ftp_file_cache_misses_total", "ftp_stat_cache_hits_total", "ftp_stat_cache_misses_total",
+    "ftp_auth_cache_hits_total", "ftp_auth_cache_misses_total", "ftp_logins_failed_total",
+    "ftp_fsync_total", "ftp_fsync_batches_total"
+  ]
+  GAUGES = ["ftp_sessions_active", "ftp_transfers_active"]
+
+  def __init__(self, commands: CommandStats) -> None:
+    self.commands = commands
+
+    self.values: Dict[str, float] = {name: 0 for name in Metrics.COUNTERS + Metrics.GAUGES}
+    self.histograms: Dict[str, Histogram] = {"ftp_transfer_duration_seconds": Histogram()}
+    self.lock = Lock()
+
+  def add(self, name: str, value: float) -> None:
+    with self.lock:
+      self.values[name] = self.values.get(name, 0) + value
+
+  def observe(self, name: str, value: float) -> None:
+    with self.lock:
+      self.histograms[name].observe(value)
+
+  def dump(self) -> List[str]:
+    with self.lock:
+      lines = [f"{name}={value}" for name, value in self.values.items()]
+
+      for name, histogram in self.histograms.items():
+        lines.append(f"{name} count={histogram.count} sum={histogram.sum:.3f}")
+
+    return lines
+
+  @staticmethod
+  def render_histogram(name: str, histogram: Histogram, labels: str = "") -> List[str]:
+    lines = []
+    total = 0
+
+    for bound, count in zip(Histogram.BUCKETS + ["+Inf"], histogram.counts):
+      total += count
+      lines.append(f'{name}_bucket{{{labels}le="{bound}"}} {total}')
+
+    labels = f"{{{labels.rstrip(',')}}}" if labels else ""
+    lines.append(f"{name}_sum{labels} {histogram.sum}")
+    lines.append(f"{name}_count{labels} {histogram.count}")
+
+    return lines
+
+  def render(self) -> str:
+    lines = []
+
+    with self.lock:
+      for name, value in self.values.items():
+        lines.append(f"# TYPE {name} {'gauge' if name in Metrics.GAUGES else 'counter'}")
+        lines.append(f"{name} {value}")
+
+      for name, histogram in self.histograms.items():
+        lines.append(f"# TYPE {name} histogram")
+        lines.extend(Metrics.render_histogram(name, histogram))
+
+    with self.commands.lock:
+      lines.append("# TYPE ftp_command_duration_seconds histogram")
+
+      for verb in sorted(self.commands.histograms):
+        lines.extend(Metrics.render_histogram(
+          "ftp_command_duration_seconds", self.commands.histograms[verb], f'verb="{verb}",'
+        ))
+
+    return "\n".join(lines) + "\n"
+
+
+class MetricsExporter:
+  def __init__(self, metrics: Metrics, host: str, port: int = 0, filepath: str = "", interval: float = 15) -> None:
+    self.metrics = metrics
+    self.host = host
+    self.port = port
+    self.filepath = filepath
+    self.interval = interval
+
+  def start(self) -> None:
+    if self.port:
+      metrics = self.metrics
+
+      class Handler(BaseHTTPRequestHandler):
+        def do_GET(self) -> None:
+          if self.path != "/metrics":
+            self.send_error(404)
+            return
+
+          body = metrics.render().encode("utf-8")
+
+          self.send_response(200)
+          self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+          self.send_header("Content-Length", str(len(body)))
+          self.end_headers()
+          self.wfile.write(body)
+
+        def log_message(self, *_) -> None:
+          pass
+
+      server = ThreadingHTTPServer((self.host, self.port), Handler)
+      Thread(target=server.serve_forever, daemon=True).start()
+
+    if self.filepath:
+      Thread(target=self.write, daemon=True).start()
+
+  def write(self) -> None:
+    while True:
+      temporary = f"{self.filepath}.tmp"
+
+      with open(temporary, "w") as file:
+        file.write(self.metrics.render())
+
+      os.replace(temporary, self.filepath)
+      time.sleep(self.interval)
@@ -0,0 +1,163 @@
+from typing import Callable, Dict, Optional
+from logger import logger
+from utils import Socket
+import os
+import signal
+import sys
+import time
+
+
+class Supervisor:
+  def __init__(self, config: dict, workers: int, factory: Callable[..., object], \
+    loader: Optional[Callable[[], dict]] = None, backoff: float = 1.0) -> None:
+    self.config = config
+    self.workers = workers
+    self.factory = factory
+    self.loader = loader
+    self.backoff = backoff
+
+    self.socket = None
+
+    self.children: Dict[int, int] = {}
+    self.started: Dict[int, float] = {}
+    self.is_running = True
+
+  def worker_config(self, index: int, config: Optional[dict] = None) -> dict:
+    config = dict(config or self.config)
+    config['worker'] = str(index)
+
+    first = int(config.get('pasv_min_port', 60001))
+    last = int(config.get('pasv_max_port', 65535))
+    span = max(1, (last - first + 1) // self.workers)
+
+    config['pasv_min_port'] = first + index * span
+    config['pasv_max_port'] = last if index == self.workers - 1 else first + (index + 1) * span - 1
+
+    if int(config.get('metrics_port', 0)):
+      config['metrics_port'] = int(config['metrics_port']) + index
+    if config.get('metrics_file'):
+      config['metrics_file'] = f"{config['metrics_file']}.{index}"
+
+    return config
+
+  def spawn(self, index: int) -> None:
+    pid = os.fork()
+
+    if pid == 0:
+      signal.signal(signal.SIGINT, signal.SIG_IGN)
+      signal.signal(signal.SIGTERM, self.interrupt)
+      signal.signal(signal.SIGUSR1, signal.SIG_DFL)
+      signal.signal(signal.SIGHUP, signal.SIG_IGN)
+      signal.signal(signal.SIGUSR2, signal.SIG_IGN)
+
+      status = 1
+      try:
+        loader = (lambda: self.worker_config(index, self.loader())) if self.loader else None
+        server = self.factory(self.worker_config(index), loader)
+
+        server.connect(self.socket)
+        server.run()
+        status = 0
+
+      except Exception as e:
+        logger.error("worker_failed", worker=index, error=str(e))
+
+      logger.flush()
+      sys.stdout.flush()
+      os._exit(status)
+
+    self.children[pid] = index
+    self.started[index] = time.monotonic()
+
+  def interrupt(self, *_) -> None:
+    raise KeyboardInterrupt
+
+  def signal_children(self, signum: int) -> None:
+    for pid in list(self.children):
+      try:
+        os.kill(pid, signum)
+      except ProcessLookupError:
+        pass
+
+  def forward(self, signum, _) -> None:
+    if signum != signal.SIGUSR1:
+      self.is_running = False
+      signum = signal.SIGTERM
+
+    self.signal_children(signum)
+
+  def reload(self, *_) -> None:
+    # Workers reload themselves; the supervisor keeps a fresh copy for the workers it respawns.
+    if self.loader:
+      try:
+        self.config = self.loader()
+      except Exception as e:
+        logger.error("reload_failed", error=str(e))
+        return
+
+    self.signal_children(signal.SIGHUP)
+
+  def handoff(self, *_) -> None:
+    if not self.is_running:
+      return
+
+    try:
+      logger.info("handoff_started", successor=Socket.handoff(self.socket))
+    except OSError as e:
+      logger.error("handoff_failed", error=str(e))
+      return
+
+    self.is_running = False
+    self.signal_children(signal.SIGUSR2)
+
+  def listen(self) -> bool:
+    self.socket = Socket.inherited()
+    if self.socket:
+      return True
+
+    listener = Socket(self.config['host'], int(self.config['port']))
+    if not listener.connect(100):
+      return False
+
+    self.socket = listener.get()
+    return True
+
+  def run(self) -> None:
+    # One listener shared by every worker, so a successor can inherit it without dropping queued connections.
+    if not self.listen():
+      logger.error("bind_failed", port=self.config['port'])
+      logger.flush()
+      return
+
+    for signum in (signal.SIGINT, signal.SIGTERM, signal.SIGUSR1):
+      signal.signal(signum, self.forward)
+
+    signal.signal(signal.SIGHUP, self.reload)
+    signal.signal(signal.SIGUSR2, self.handoff)
+
+    for index in range(self.workers):
+      self.spawn(index)
+
+    logger.info("supervisor_started", workers=self.workers, port=self.config['port'])
+
+    while self.children:
+      try:
+        pid, status = os.wait()
+      except ChildProcessError:
+        break
+
+      index = self.children.pop(pid, None)
+      if index is None or not self.is_running:
+        continue
+
+      logger.warning("worker_restarted", worker=index, pid=pid, status=os.waitstatus_to_exitcode(status))
+
+      if time.monotonic() - self.started[index] < self.backoff:
+        time.sleep(self.backoff)
+
+      if self.is_running:
+        self.spawn(index)
+
+    logger.info("supervisor_closing")
+    self.socket.close()
+    logger.flush()
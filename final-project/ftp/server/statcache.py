@@ -0,0 +1,50 @@
+from collections import OrderedDict
+from threading import Lock
+from typing import Optional, Tuple
+from vfs import FileSystem, LocalFileSystem
+import os
+import time
+
+
+class StatCache:
+  def __init__(self, ttl: float = 1.0, capacity: int = 4096, filesystem: Optional[FileSystem] = None) -> None:
+    self.ttl = ttl
+    self.capacity = capacity
+    self.filesystem = filesystem or LocalFileSystem()
+
+    self.entries: "OrderedDict[str, Tuple[float, Optional[os.stat_result]]]" = OrderedDict()
+    self.lock = Lock()
+
+  def put(self, path: str, stats: Optional[os.stat_result]) -> None:
+    if not self.ttl:
+      return
+
+    key = os.path.normpath(path)
+
+    with self.lock:
+      self.entries[key] = (time.monotonic() + self.ttl, stats)
+      self.entries.move_to_end(key)
+
+      while len(self.entries) > self.capacity:
+        self.entries.popitem(last=False)
+
+  def invalidate(self, path: str) -> None:
+    with self.lock:
+      self.entries.pop(os.path.normpath(path), None)
+
+  def lookup(self, path: str) -> Tuple[Optional[os.stat_result], bool]:
+    key = os.path.normpath(path)
+
+    with self.lock:
+      entry = self.entries.get(key)
+      if entry and entry[0] > time.monotonic():
+        self.entries.move_to_end(key)
+        return entry[1], True
+
+    try:
+      stats = self.filesystem.stat(path)
+    except (FileNotFoundError, NotADirectoryError):
+      stats = None
+
+    self.put(path, stats)
+    return stats, False
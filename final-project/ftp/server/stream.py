@@ -0,0 +1,234 @@
+from metrics import Metrics
+from throttle import Throttle
+from typing import BinaryIO, Optional
+import io
+import os
+import socket
+import struct
+import zlib
+
+
+class DataStream:
+  def __init__(self, data_socket: socket.socket, throttle: Optional[Throttle] = None, \
+    metrics: Optional[Metrics] = None) -> None:
+    self.socket = data_socket
+    self.throttle = throttle
+    self.metrics = metrics
+
+  def set_compressible(self, compressible: bool) -> None:
+    pass
+
+  def flush(self) -> None:
+    pass
+
+  def count(self, name: str, size: int) -> None:
+    if self.metrics and size:
+      self.metrics.add(name, size)
+
+  def sendall(self, data: bytes) -> None:
+    self.count("ftp_bytes_sent_total", len(data))
+
+    if not self.throttle:
+      self.socket.sendall(data)
+      return
+
+    data = memoryview(data)
+    for index in range(0, len(data), self.throttle.chunk_size):
+      chunk = data[index:index + self.throttle.chunk_size]
+
+      self.throttle.consume(len(chunk))
+      self.socket.sendall(chunk)
+
+  def sendfile(self, file: BinaryIO, offset: int = 0, count: Optional[int] = None) -> int:
+    if isinstance(file, io.BytesIO):
+      file.seek(offset)
+      content = file.read(-1 if count is None else count)
+
+      self.sendall(memoryview(content))
+      return len(content)
+
+    if not self.throttle:
+      total = self.socket.sendfile(file, offset, count)
+      self.count("ftp_bytes_sent_total", total)
+
+      return total
+
+    total = 0
+    while count is None or total < count:
+      size = self.throttle.chunk_size if count is None else min(self.throttle.chunk_size, count - total)
+      self.throttle.consume(size)
+
+      sent = self.socket.sendfile(file, offset + total, size)
+      if not sent:
+        break
+
+      total += sent
+      self.count("ftp_bytes_sent_total", sent)
+
+    return total
+
+  def recv_into(self, buffer: memoryview) -> int:
+    if not self.throttle:
+      size = self.socket.recv_into(buffer)
+    else:
+      size = self.socket.recv_into(buffer, min(len(buffer), self.throttle.chunk_size))
+      self.throttle.consume(size)
+
+    self.count("ftp_bytes_received_total", size)
+    return size
+
+
+class DeflateStream:
+  def __init__(self, stream: DataStream, level: int = 6, chunk_size: int = 64 * 1024) -> None:
+    self.stream = stream
+    self.level = level
+    self.chunk_size = chunk_size
+
+    self.compressor = None
+    self.decompressor = zlib.decompressobj()
+
+    self.raw: bytearray = None
+    self.pending = b""
+    self.is_receiving = False
+
+  def set_compressible(self, compressible: bool) -> None:
+    if not compressible:
+      self.level = 0
+
+  def sendall(self, data: bytes) -> None:
+    if not self.compressor:
+      self.compressor = zlib.compressobj(self.level)
+
+    data = self.compressor.compress(data)
+    if data:
+      self.stream.sendall(data)
+
+  def sendfile(self, file: BinaryIO, offset: int = 0) -> int:
+    file.seek(offset)
+
+    total = 0
+    while True:
+      data = file.read(self.chunk_size)
+      if not data:
+        break
+
+      self.sendall(data)
+      total += len(data)
+
+    return total
+
+  def flush(self) -> None:
+    if self.is_receiving:
+      return
+
+    if not self.compressor:
+      self.compressor = zlib.compressobj(self.level)
+
+    self.stream.sendall(self.compressor.flush())
+
+  def recv_into(self, buffer: memoryview) -> int:
+    self.is_receiving = True
+
+    if not self.raw:
+      self.raw = bytearray(len(buffer))
+
+    while True:
+      if self.pending:
+        data = self.pending
+
+      elif self.decompressor.unconsumed_tail:
+        data = self.decompressor.decompress(self.decompressor.unconsumed_tail, len(buffer))
+
+      else:
+        size = self.stream.recv_into(memoryview(self.raw))
+
+        if size:
+          data = self.decompressor.decompress(memoryview(self.raw)[:size], len(buffer))
+        else:
+          data = self.decompressor.flush()
+          if not data:
+            return 0
+
+      size = min(len(buffer), len(data))
+      buffer[:size] = data[:size]
+      self.pending = data[size:]
+
+      if size:
+        return size
+
+
+class BlockStream:
+  HEADER = struct.Struct("!BH")
+  EOF = 64
+  MAX_BLOCK = 65535
+
+  def __init__(self, stream: DataStream) -> None:
+    self.stream = stream
+
+    self.remaining = 0
+    self.is_eof = False
+    self.is_receiving = False
+
+    try:
+      self.stream.socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    except OSError:
+      pass
+
+  def set_compressible(self, compressible: bool) -> None:
+    pass
+
+  def sendall(self, data: bytes) -> None:
+    data = memoryview(data)
+
+    for index in range(0, len(data), BlockStream.MAX_BLOCK):
+      block = data[index:index + BlockStream.MAX_BLOCK]
+
+      self.stream.sendall(BlockStream.HEADER.pack(0, len(block)) + block)
+
+  def sendfile(self, file: BinaryIO, offset: int = 0) -> int:
+    size = file.seek(0, os.SEEK_END)
+
+    total = 0
+    while offset + total < size:
+      count = min(BlockStream.MAX_BLOCK, size - offset - total)
+
+      self.stream.sendall(BlockStream.HEADER.pack(0, count))
+      if self.stream.sendfile(file, offset + total, count) != count:
+        raise OSError("File changed during transfer.")
+
+      total += count
+
+    return total
+
+  def flush(self) -> None:
+    if not self.is_receiving:
+      self.stream.sendall(BlockStream.HEADER.pack(BlockStream.EOF, 0))
+
+  def read_exactly(self, buffer: memoryview) -> None:
+    received = 0
+    while received < len(buffer):
+      size = self.stream.recv_into(buffer[received:])
+      if not size:
+        raise OSError("Data connection closed inside a block.")
+
+      received += size
+
+  def recv_into(self, buffer: memoryview) -> int:
+    self.is_receiving = True
+
+    while not self.remaining:
+      if self.is_eof:
+        return 0
+
+      header = bytearray(BlockStream.HEADER.size)
+      self.read_exactly(memoryview(header))
+
+      descriptor, self.remaining = BlockStream.HEADER.unpack(header)
+      self.is_eof = bool(descriptor & BlockStream.EOF)
+
+    size = self.stream.recv_into(buffer[:min(len(buffer), self.remaining)])
+    if not size:
+      raise OSError("Data connection closed inside a block.")
+
+    self.remaining -= size
+    return size
@@ -0,0 +1,72 @@
+from threading import Lock
+from typing import Dict, List, Optional
+import time
+
+
+class TokenBucket:
+  def __init__(self, rate: float, burst: Optional[float] = None) -> None:
+    self.rate = rate
+    self.capacity = burst or rate / 10
+
+    self.tokens = self.capacity
+    self.timestamp = time.monotonic()
+    self.lock = Lock()
+
+  def reserve(self, amount: int) -> float:
+    with self.lock:
+      now = time.monotonic()
+      self.tokens = min(self.capacity, self.tokens + (now - self.timestamp) * self.rate)
+      self.timestamp = now
+
+      # Reservations may overdraw the bucket; later callers queue up behind the debt in arrival order.
+      self.tokens -= amount
+
+      return max(0.0, -self.tokens / self.rate)
+
+
+class Throttle:
+  def __init__(self, buckets: List[TokenBucket]) -> None:
+    self.buckets = buckets
+    self.chunk_size = max(4096, int(min(bucket.rate for bucket in buckets) / 20))
+
+  def consume(self, amount: int) -> None:
+    delay = max(bucket.reserve(amount) for bucket in self.buckets)
+
+    if delay:
+      time.sleep(delay)
+
+
+class Bandwidth:
+  def __init__(self, rate: int = 0, session_rate: int = 0, user_rate: int = 0) -> None:
+    self.lock = Lock()
+    self.configure(rate, session_rate, user_rate)
+
+  def configure(self, rate: int = 0, session_rate: int = 0, user_rate: int = 0) -> None:
+    # Sessions keep the throttle they got at login; new logins pick up the new limits.
+    with self.lock:
+      self.session_rate = session_rate
+      self.user_rate = user_rate
+
+      self.bucket = TokenBucket(rate) if rate else None
+      self.users: Dict[str, TokenBucket] = {}
+
+  def throttle(self, user: str) -> Optional[Throttle]:
+    buckets = []
+
+    if self.bucket:
+      buckets.append(self.bucket)
+
+    if self.session_rate:
+      buckets.append(TokenBucket(self.session_rate))
+
+    if self.user_rate:
+      with self.lock:
+        if user not in self.users:
+          self.users[user] = TokenBucket(self.user_rate)
+
+        buckets.append(self.users[user])
+
+    if buckets:
+      return Throttle(buckets)
+
+    return None
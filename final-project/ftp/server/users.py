@@ -0,0 +1,152 @@
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from logger import logger
+from threading import Lock
+from typing import Dict, Iterable, Optional, Tuple
+import base64
+import hashlib
+import hmac
+import os
+import time
+
+
+class User:
+  def __init__(self, name: str, hash: str, home: str = "/") -> None:
+    self.name = name
+    self.hash = hash
+    self.home = home
+
+
+class PasswordHash:
+  SCRYPT = (2 ** 14, 8, 1)
+  PBKDF2_ITERATIONS = 600000
+
+  @staticmethod
+  def encode(data: bytes) -> str:
+    return base64.b64encode(data).decode("ascii")
+
+  @staticmethod
+  def decode(data: str) -> bytes:
+    return base64.b64decode(data.encode("ascii"))
+
+  @staticmethod
+  def create(password: str, scheme: str = "scrypt") -> str:
+    salt = os.urandom(16)
+
+    if scheme == "scrypt":
+      n, r, p = PasswordHash.SCRYPT
+      key = hashlib.scrypt(password.encode("utf-8"), salt=salt, n=n, r=r, p=p, dklen=32)
+
+      return f"scrypt${n}${r}${p}${PasswordHash.encode(salt)}${PasswordHash.encode(key)}"
+
+    if scheme == "pbkdf2":
+      iterations = PasswordHash.PBKDF2_ITERATIONS
+      key = hashlib.pbkdf2_hmac("sha256", password.encode("utf-8"), salt, iterations)
+
+      return f"pbkdf2_sha256${iterations}${PasswordHash.encode(salt)}${PasswordHash.encode(key)}"
+
+    raise ValueError(f"Unknown password scheme: {scheme}")
+
+  @staticmethod
+  def is_valid(encoded: str) -> bool:
+    fields = encoded.split("$")
+    return (fields[0] == "scrypt" and len(fields) == 6) or (fields[0] == "pbkdf2_sha256" and len(fields) == 4)
+
+  @staticmethod
+  def verify(encoded: str, password: str) -> bool:
+    fields = encoded.split("$")
+
+    try:
+      if fields[0] == "scrypt":
+        n, r, p = int(fields[1]), int(fields[2]), int(fields[3])
+        salt, expected = PasswordHash.decode(fields[4]), PasswordHash.decode(fields[5])
+
+        key = hashlib.scrypt(password.encode("utf-8"), salt=salt, n=n, r=r, p=p, dklen=len(expected),
+          maxmem=256 * n * r * p)
+
+      elif fields[0] == "pbkdf2_sha256":
+        iterations = int(fields[1])
+        salt, expected = PasswordHash.decode(fields[2]), PasswordHash.decode(fields[3])
+
+        key = hashlib.pbkdf2_hmac("sha256", password.encode("utf-8"), salt, iterations, len(expected))
+
+      else:
+        return False
+
+    except (ValueError, IndexError):
+      return False
+
+    return hmac.compare_digest(key, expected)
+
+
+class UserStore:
+  def __init__(self, workers: int = 4, cache_ttl: float = 60.0, cache_size: int = 4096) -> None:
+    self.users: Dict[str, User] = {}
+
+    self.pool = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="auth")
+
+    self.cache_ttl = cache_ttl
+    self.cache_size = cache_size
+    self.cache: "OrderedDict[bytes, float]" = OrderedDict()
+    self.secret = os.urandom(32)
+    self.lock = Lock()
+
+  def add(self, user: User) -> None:
+    self.users[user.name] = user
+
+  def load(self, filepath: str) -> None:
+    users: Dict[str, User] = {}
+
+    with open(filepath, "r") as file:
+      for number, line in enumerate(file, 1):
+        line = line.strip()
+        if not line or line.startswith("#"):
+          continue
+
+        fields = line.split(":")
+        if len(fields) < 2 or not PasswordHash.is_valid(fields[1]):
+          logger.warning("user_skipped", file=filepath, line=number)
+          continue
+
+        home = fields[2] if len(fields) > 2 and fields[2] else "/"
+        users[fields[0]] = User(fields[0], fields[1], home)
+
+    self.replace(users.values())
+
+  def replace(self, users: Iterable[User]) -> None:
+    self.users = {user.name: user for user in users}
+
+    with self.lock:
+      self.cache.clear()
+
+  def get(self, name: str) -> Optional[User]:
+    return self.users.get(name)
+
+  def fingerprint(self, user: User, password: str) -> bytes:
+    return hmac.new(self.secret, f"{user.name}\0{user.hash}\0{password}".encode("utf-8"), hashlib.sha256).digest()
+
+  def verify(self, name: str, password: str) -> Tuple[Optional[User], bool]:
+    user = self.get(name)
+    if not user:
+      return None, False
+
+    key = self.fingerprint(user, password)
+
+    with self.lock:
+      expires = self.cache.get(key)
+      if expires and expires > time.monotonic():
+        self.cache.move_to_end(key)
+        return user, True
+
+    if not self.pool.submit(PasswordHash.verify, user.hash, password).result():
+      return None, False
+
+    if self.cache_ttl:
+      with self.lock:
+        self.cache[key] = time.monotonic() + self.cache_ttl
+        self.cache.move_to_end(key)
+
+        while len(self.cache) > self.cache_size:
+          self.cache.popitem(last=False)
+
+    return user, False
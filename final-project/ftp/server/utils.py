@@ -1,20 +1,30 @@
+from collections import deque
+from logger import logger
+from threading import Lock
+from typing import List, Optional, Set
+import os
 import socket
+import subprocess
+import sys
 
 
 class Socket:
+  INHERITED = "FTP_LISTEN_FD"
+
   def __init__(self, host: str, port: int) -> None:
     self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
 
     self.host = host
     self.port = port
   
-  def connect(self, listen_for: int = 1):
+  def connect(self, listen_for: int = 1, reuse_port: bool = True):
     try:
       self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-      try:
-        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
-      except AttributeError:
-        pass
+      if reuse_port:
+        try:
+          self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        except AttributeError:
+          pass
 
       self.socket.bind((self.host, self.port))
       self.socket.listen(listen_for)
@@ -27,6 +37,114 @@ class Socket:
   def get(self) -> socket.socket:
     return self.socket
 
+  @staticmethod
+  def inherited() -> Optional[socket.socket]:
+    descriptor = os.environ.pop(Socket.INHERITED, "")
+    if not descriptor:
+      return None
+
+    return socket.socket(fileno=int(descriptor))
+
+  @staticmethod
+  def handoff(listener: socket.socket) -> int:
+    descriptor = listener.fileno()
+    environment = dict(os.environ, **{Socket.INHERITED: str(descriptor)})
+    process = subprocess.Popen([sys.executable] + sys.argv, env=environment, pass_fds=(descriptor,))
+
+    return process.pid
+
+
+class PortPool:
+  def __init__(self, host: str, first: int, last: int, attempts: int = 8) -> None:
+    self.host = host
+    self.first = first
+    self.last = last
+    self.attempts = attempts
+
+    self.ports = deque(range(first, last + 1))
+    self.used: Set[int] = set()
+    self.lock = Lock()
+
+  def configure(self, first: int, last: int) -> None:
+    with self.lock:
+      if (first, last) == (self.first, self.last):
+        return
+
+      self.first = first
+      self.last = last
+
+      # Ports still held by sessions rejoin the pool when they are released.
+      self.ports = deque(port for port in range(first, last + 1) if port not in self.used)
+
+  def acquire(self) -> Optional[socket.socket]:
+    for _ in range(self.attempts):
+      with self.lock:
+        if not self.ports:
+          break
+
+        port = self.ports.popleft()
+        self.used.add(port)
+
+      data_socket = Socket(self.host, port)
+      if data_socket.connect(reuse_port=False):
+        return data_socket.get()
+
+      data_socket.get().close()
+
+      with self.lock:
+        self.used.discard(port)
+        self.ports.append(port)
+
+    data_socket = Socket(self.host, 0)
+    if data_socket.connect(reuse_port=False):
+      return data_socket.get()
+
+    data_socket.get().close()
+    return None
+
+  def release(self, data_socket: socket.socket) -> None:
+    try:
+      port = data_socket.getsockname()[1]
+    except OSError:
+      return
+
+    data_socket.close()
+
+    with self.lock:
+      if port not in self.used:
+        return
+
+      self.used.discard(port)
+      if self.first <= port <= self.last:
+        self.ports.append(port)
+
+
+class LineReader:
+  def __init__(self, limit: int = 8192) -> None:
+    self.limit = limit
+    self.buffer = bytearray()
+
+  def feed(self, data: bytes) -> List[str]:
+    self.buffer += data
+
+    lines = []
+    while True:
+      index = self.buffer.find(b"\n")
+      if index < 0:
+        break
+
+      line = bytes(self.buffer[:index]).rstrip(b"\r").decode("utf-8", errors="replace")
+      del self.buffer[:index + 1]
+
+      if line.strip():
+        lines.append(line)
+
+    if len(self.buffer) > self.limit:
+      self.buffer.clear()
+      raise ValueError("Command line too long.")
+
+    return lines
+
 
 class Reply:
   def __init__(self, code = 500, message = "Command unrecognized.") -> None:
@@ -47,10 +165,17 @@ class Reply:
 
   def get(self) -> str:
     return self.reply
+
+  @staticmethod
+  def multiline(code: int, header: str, lines: List[str], footer: str):
+    reply = Reply(code, footer)
+    reply.reply = f'{code}-{header}\r\n' + ''.join(f'{line}\r\n' for line in lines) + reply.reply
+
+    return reply
   
   @staticmethod
   def handle_error(e):
-    print(e)
+    logger.error("error", error=str(e))
     return Reply(451, "Requested action aborted. Local error in processing.")
 
 
@@ -88,3 +213,10 @@ class Path:
       second = second[:-1]
 
     return f"{first}{second}"
+
+  @staticmethod
+  def is_inside(root: str, path: str) -> bool:
+    root = os.path.normpath(root)
+    path = os.path.normpath(path)
+
+    return path == root or path.startswith(root.rstrip("/") + "/")
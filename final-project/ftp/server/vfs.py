@@ -0,0 +1,499 @@
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from threading import Lock, RLock
+from typing import BinaryIO, Dict, Iterator, List, Optional, Tuple
+import errno
+import io
+import itertools
+import os
+import stat
+import time
+
+
+def is_settled(stats: os.stat_result) -> bool:
+  # Anything modified within the current mtime tick could change again without its mtime moving.
+  return time.time_ns() - stats.st_mtime_ns > 1_000_000_000
+
+
+def is_plain(stats: os.stat_result) -> bool:
+  # Copying a tree skips links, so nothing outside of it is ever read.
+  return stat.S_ISDIR(stats.st_mode) or stat.S_ISREG(stats.st_mode)
+
+
+class Entry:
+  def __init__(self, name: str, path: str, stats: os.stat_result) -> None:
+    self.name = name
+    self.path = path
+    self.stats = stats
+
+  def is_dir(self) -> bool:
+    return stat.S_ISDIR(self.stats.st_mode)
+
+  def is_file(self) -> bool:
+    return stat.S_ISREG(self.stats.st_mode)
+
+  def is_symlink(self) -> bool:
+    return stat.S_ISLNK(self.stats.st_mode)
+
+
+class FileSystem(ABC):
+  @abstractmethod
+  def stat(self, path: str) -> os.stat_result:
+    ...
+
+  def lstat(self, path: str) -> os.stat_result:
+    return self.stat(path)
+
+  @abstractmethod
+  def scandir(self, path: str) -> Iterator[Entry]:
+    ...
+
+  @abstractmethod
+  def open(self, path: str, mode: str = "rb") -> BinaryIO:
+    ...
+
+  @abstractmethod
+  def mkdir(self, path: str) -> None:
+    ...
+
+  @abstractmethod
+  def rmdir(self, path: str) -> None:
+    ...
+
+  @abstractmethod
+  def remove(self, path: str) -> None:
+    ...
+
+  @abstractmethod
+  def rename(self, source: str, target: str) -> None:
+    ...
+
+  def replace(self, source: str, target: str) -> None:
+    self.rename(source, target)
+
+  def fsync(self, file: BinaryIO) -> None:
+    pass
+
+  def fsync_directory(self, path: str) -> None:
+    pass
+
+  def readlink(self, path: str) -> str:
+    raise OSError(errno.EINVAL, os.strerror(errno.EINVAL), path)
+
+  def realpath(self, path: str) -> str:
+    return os.path.normpath(os.path.abspath(path))
+
+  def exists(self, path: str) -> bool:
+    try:
+      self.stat(path)
+    except OSError:
+      return False
+
+    return True
+
+  def isdir(self, path: str) -> bool:
+    try:
+      return stat.S_ISDIR(self.stat(path).st_mode)
+    except OSError:
+      return False
+
+  def isfile(self, path: str) -> bool:
+    try:
+      return stat.S_ISREG(self.stat(path).st_mode)
+    except OSError:
+      return False
+
+  def walk(self, path: str) -> Iterator[Tuple[str, List[str], List[str]]]:
+    dirnames, filenames = [], []
+
+    for entry in self.scandir(path):
+      (dirnames if entry.is_dir() else filenames).append(entry.name)
+
+    yield path, dirnames, filenames
+
+    for name in dirnames:
+      yield from self.walk(os.path.join(path, name))
+
+
+class LocalFileSystem(FileSystem):
+  def stat(self, path: str) -> os.stat_result:
+    return os.stat(path)
+
+  def lstat(self, path: str) -> os.stat_result:
+    return os.lstat(path)
+
+  def scandir(self, path: str) -> Iterator[Entry]:
+    with os.scandir(path) as entries:
+      for entry in entries:
+        # Entries removed between readdir and stat (e.g. a renamed upload) are simply not listed.
+        try:
+          stats = entry.stat(follow_symlinks=False)
+        except FileNotFoundError:
+          continue
+
+        yield Entry(entry.name, entry.path, stats)
+
+  def open(self, path: str, mode: str = "rb") -> BinaryIO:
+    return open(path, mode)
+
+  def mkdir(self, path: str) -> None:
+    os.mkdir(path)
+
+  def rmdir(self, path: str) -> None:
+    os.rmdir(path)
+
+  def remove(self, path: str) -> None:
+    os.remove(path)
+
+  def rename(self, source: str, target: str) -> None:
+    os.rename(source, target)
+
+  def replace(self, source: str, target: str) -> None:
+    os.replace(source, target)
+
+  def fsync(self, file: BinaryIO) -> None:
+    file.flush()
+    os.fsync(file.fileno())
+
+  def fsync_directory(self, path: str) -> None:
+    descriptor = os.open(path, os.O_RDONLY | getattr(os, "O_DIRECTORY", 0))
+
+    try:
+      os.fsync(descriptor)
+    finally:
+      os.close(descriptor)
+
+  def readlink(self, path: str) -> str:
+    return os.readlink(path)
+
+  def realpath(self, path: str) -> str:
+    return os.path.realpath(path)
+
+
+class Node:
+  def __init__(self, mode: int, ino: int) -> None:
+    self.mode = mode
+    self.ino = ino
+    self.data = b""
+    self.children: Optional[Dict[str, "Node"]] = {} if stat.S_ISDIR(mode) else None
+    self.mtime_ns = time.time_ns()
+
+  def stats(self) -> os.stat_result:
+    if self.children is None:
+      size, nlink = len(self.data), 1
+    else:
+      size, nlink = 0, 2 + sum(child.children is not None for child in self.children.values())
+
+    mtime = self.mtime_ns / 1e9
+    return os.stat_result(
+      (self.mode, self.ino, 0, nlink, os.getuid(), os.getgid(), size, int(mtime), int(mtime), int(mtime)),
+      {"st_atime": mtime, "st_mtime": mtime, "st_ctime": mtime, "st_atime_ns": self.mtime_ns,
+       "st_mtime_ns": self.mtime_ns, "st_ctime_ns": self.mtime_ns}
+    )
+
+
+class MemoryFile(io.BytesIO):
+  def __init__(self, filesystem: "MemoryFileSystem", path: str, data: bytes) -> None:
+    io.BytesIO.__init__(self, data)
+
+    self.filesystem = filesystem
+    self.path = path
+
+  def close(self) -> None:
+    if self.closed:
+      return
+
+    try:
+      self.filesystem.write(self.path, self.getvalue())
+    finally:
+      io.BytesIO.close(self)
+
+
+class MemoryFileSystem(FileSystem):
+  def __init__(self, capacity: int = 0) -> None:
+    self.capacity = capacity
+    self.size = 0
+
+    self.inodes = itertools.count(1)
+    self.tree = Node(stat.S_IFDIR | 0o755, next(self.inodes))
+    self.lock = RLock()
+
+  @staticmethod
+  def error(code: int, path: str) -> OSError:
+    return OSError(code, os.strerror(code), path)
+
+  def parts(self, path: str) -> List[str]:
+    return [part for part in self.realpath(path).split("/") if part]
+
+  def node(self, path: str) -> Node:
+    node = self.tree
+
+    for part in self.parts(path):
+      if node.children is None:
+        raise self.error(errno.ENOTDIR, path)
+
+      node = node.children.get(part)
+      if not node:
+        raise self.error(errno.ENOENT, path)
+
+    return node
+
+  def parent(self, path: str) -> Tuple[Node, str]:
+    parts = self.parts(path)
+    if not parts:
+      raise self.error(errno.EBUSY, path)
+
+    parent = self.node("/" + "/".join(parts[:-1]))
+    if parent.children is None:
+      raise self.error(errno.ENOTDIR, path)
+
+    return parent, parts[-1]
+
+  def stat(self, path: str) -> os.stat_result:
+    with self.lock:
+      return self.node(path).stats()
+
+  def scandir(self, path: str) -> Iterator[Entry]:
+    with self.lock:
+      node = self.node(path)
+      if node.children is None:
+        raise self.error(errno.ENOTDIR, path)
+
+      entries = [Entry(name, os.path.join(path, name), child.stats()) for name, child in node.children.items()]
+
+    return iter(entries)
+
+  def open(self, path: str, mode: str = "rb") -> BinaryIO:
+    with self.lock:
+      if "w" in mode or "a" in mode:
+        data = b""
+        if "a" in mode and self.isfile(path):
+          data = self.node(path).data
+
+        self.write(path, data)
+
+      node = self.node(path)
+      if node.children is not None:
+        raise self.error(errno.EISDIR, path)
+
+      if "w" in mode:
+        file = MemoryFile(self, path, b"")
+      elif "a" in mode:
+        file = MemoryFile(self, path, node.data)
+        file.seek(0, io.SEEK_END)
+      elif "+" in mode:
+        file = MemoryFile(self, path, node.data)
+      else:
+        file = io.BytesIO(node.data)
+
+    if "b" not in mode:
+      return io.TextIOWrapper(file, encoding="utf-8")
+
+    return file
+
+  def write(self, path: str, data: bytes) -> None:
+    data = bytes(data)
+
+    with self.lock:
+      parent, name = self.parent(path)
+
+      node = parent.children.get(name)
+      if node and node.children is not None:
+        raise self.error(errno.EISDIR, path)
+
+      previous = len(node.data) if node else 0
+      if self.capacity and self.size - previous + len(data) > self.capacity:
+        raise self.error(errno.ENOSPC, path)
+
+      if not node:
+        node = parent.children[name] = Node(stat.S_IFREG | 0o644, next(self.inodes))
+        parent.mtime_ns = time.time_ns()
+
+      self.size += len(data) - previous
+      node.data = data
+      node.mtime_ns = time.time_ns()
+
+  def mkdir(self, path: str) -> None:
+    with self.lock:
+      parent, name = self.parent(path)
+      if name in parent.children:
+        raise self.error(errno.EEXIST, path)
+
+      parent.children[name] = Node(stat.S_IFDIR | 0o755, next(self.inodes))
+      parent.mtime_ns = time.time_ns()
+
+  def makedirs(self, path: str) -> None:
+    with self.lock:
+      current = ""
+
+      for part in self.parts(path):
+        current += "/" + part
+        if not self.isdir(current):
+          self.mkdir(current)
+
+  def rmdir(self, path: str) -> None:
+    with self.lock:
+      parent, name = self.parent(path)
+
+      node = self.node(path)
+      if node.children is None:
+        raise self.error(errno.ENOTDIR, path)
+      if node.children:
+        raise self.error(errno.ENOTEMPTY, path)
+
+      del parent.children[name]
+      parent.mtime_ns = time.time_ns()
+
+  def remove(self, path: str) -> None:
+    with self.lock:
+      parent, name = self.parent(path)
+
+      node = self.node(path)
+      if node.children is not None:
+        raise self.error(errno.EISDIR, path)
+
+      del parent.children[name]
+      parent.mtime_ns = time.time_ns()
+      self.size -= len(node.data)
+
+  def rename(self, source: str, target: str) -> None:
+    with self.lock:
+      source_parent, source_name = self.parent(source)
+      target_parent, target_name = self.parent(target)
+
+      node = self.node(source)
+      if (self.realpath(target) + "/").startswith(self.realpath(source) + "/"):
+        raise self.error(errno.EINVAL, target)
+
+      replaced = target_parent.children.get(target_name)
+      if replaced:
+        if (replaced.children is None) != (node.children is None):
+          raise self.error(errno.EISDIR if replaced.children is not None else errno.ENOTDIR, target)
+        if replaced.children:
+          raise self.error(errno.ENOTEMPTY, target)
+
+        self.size -= len(replaced.data)
+
+      del source_parent.children[source_name]
+      target_parent.children[target_name] = node
+
+      source_parent.mtime_ns = target_parent.mtime_ns = time.time_ns()
+
+  def load(self, path: str, source: FileSystem) -> None:
+    self.makedirs(path)
+    if not source.isdir(path):
+      return
+
+    for dirpath, dirnames, filenames in source.walk(path):
+      for name in dirnames:
+        self.makedirs(os.path.join(dirpath, name))
+
+      for name in filenames:
+        filepath = os.path.join(dirpath, name)
+
+        if is_plain(source.lstat(filepath)):
+          with source.open(filepath, "rb") as file:
+            self.write(filepath, file.read())
+
+
+class OverlayFileSystem(FileSystem):
+  def __init__(self, lower: FileSystem, upper: MemoryFileSystem, max_file_size: int = 16 * 1024 * 1024) -> None:
+    self.lower = lower
+    self.upper = upper
+    self.max_file_size = max_file_size
+
+    self.promoted: "OrderedDict[str, Tuple[int, int]]" = OrderedDict()
+    self.lock = Lock()
+
+  def stat(self, path: str) -> os.stat_result:
+    return self.lower.stat(path)
+
+  def lstat(self, path: str) -> os.stat_result:
+    return self.lower.lstat(path)
+
+  def scandir(self, path: str) -> Iterator[Entry]:
+    return self.lower.scandir(path)
+
+  def readlink(self, path: str) -> str:
+    return self.lower.readlink(path)
+
+  def realpath(self, path: str) -> str:
+    return self.lower.realpath(path)
+
+  def evict(self, path: str) -> None:
+    key = self.realpath(path)
+
+    with self.lock:
+      for promoted in [promoted for promoted in self.promoted if (promoted + "/").startswith(key + "/")]:
+        del self.promoted[promoted]
+
+        try:
+          self.upper.remove(promoted)
+        except OSError:
+          pass
+
+  def promote(self, key: str, stats: os.stat_result, content: bytes) -> bool:
+    with self.lock:
+      while self.promoted and self.upper.capacity and self.upper.size + len(content) > self.upper.capacity:
+        evicted, _ = self.promoted.popitem(last=False)
+        self.upper.remove(evicted)
+
+      try:
+        self.upper.makedirs(os.path.dirname(key))
+        self.upper.write(key, content)
+      except OSError:
+        return False
+
+      self.promoted[key] = (stats.st_mtime_ns, stats.st_size)
+      return True
+
+  def open(self, path: str, mode: str = "rb") -> BinaryIO:
+    if "r" not in mode or "+" in mode:
+      self.evict(path)
+      return self.lower.open(path, mode)
+
+    stats = self.lower.stat(path)
+    key = self.realpath(path)
+
+    with self.lock:
+      if self.promoted.get(key) == (stats.st_mtime_ns, stats.st_size):
+        self.promoted.move_to_end(key)
+        return self.upper.open(key, mode)
+
+    if not stat.S_ISREG(stats.st_mode) or stats.st_size > self.max_file_size:
+      return self.lower.open(path, mode)
+
+    with self.lower.open(path, "rb") as file:
+      content = file.read(self.max_file_size + 1)
+
+    if len(content) != stats.st_size or not is_settled(stats) or not self.promote(key, stats, content):
+      return self.lower.open(path, mode)
+
+    return self.upper.open(key, mode)
+
+  def mkdir(self, path: str) -> None:
+    self.lower.mkdir(path)
+
+  def rmdir(self, path: str) -> None:
+    self.lower.rmdir(path)
+    self.evict(path)
+
+  def remove(self, path: str) -> None:
+    self.lower.remove(path)
+    self.evict(path)
+
+  def rename(self, source: str, target: str) -> None:
+    self.lower.rename(source, target)
+    self.evict(source)
+    self.evict(target)
+
+  def replace(self, source: str, target: str) -> None:
+    self.lower.replace(source, target)
+    self.evict(source)
+    self.evict(target)
+
+  def fsync(self, file: BinaryIO) -> None:
+    self.lower.fsync(file)
+
+  def fsync_directory(self, path: str) -> None:
+    self.lower.fsync_directory(path)